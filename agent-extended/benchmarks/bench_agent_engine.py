@@ -0,0 +1,124 @@
+"""
+Micro benchmark of the time an agent turn takes with the langchain AgentExecutor and with the
+native tool calling loop (AGENT_ENGINE=native).
+
+Both engines use the same OpenAI client, which gets responses streamed from a local fake model
+(an in process HTTP transport), so measured times are the overhead of each engine and the client.
+
+Run from agent-extended folder with: python -m benchmarks.bench_agent_engine
+"""
+import asyncio
+import contextlib
+import io
+import json
+import time
+from typing import Awaitable, Callable, List
+
+import httpx
+from langchain.memory import ChatMessageHistory, ConversationBufferMemory
+from langchain_community.chat_models import ChatOpenAI
+from openai import AsyncOpenAI
+
+from gpt_agent.agent import Agent, SYSTEM_PROMPT, clock, contact_abstracta
+from gpt_agent.native_agent import NativeAgent
+from gpt_agent.tool_dispatch import tool_dispatcher
+
+
+def _sse_chunk(delta: dict, finish_reason: str | None = None) -> bytes:
+    chunk = {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+             "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+    return f"data: {json.dumps(chunk)}\n\n".encode()
+
+
+def build_answer(tokens: int) -> List[str]:
+    return (["RAZONAMIENTO:\n"] + [f"paso {i} " for i in range(tokens - 2)]
+            + ["\nRESPUESTA FINAL:\nlisto"])
+
+
+def build_fake_model(tokens: int) -> httpx.MockTransport:
+    answer = b"".join(_sse_chunk({"content": token}) for token in build_answer(tokens))
+    answer += _sse_chunk({}, "stop") + b"data: [DONE]\n\n"
+    function_call = (_sse_chunk({"role": "assistant", "function_call": {"name": "clock", "arguments": ""}})
+                     + _sse_chunk({"function_call": {"arguments": "{}"}})
+                     + _sse_chunk({}, "function_call") + b"data: [DONE]\n\n")
+    tool_call = (_sse_chunk({"role": "assistant", "tool_calls": [
+        {"index": 0, "id": "call_0", "type": "function", "function": {"name": "clock", "arguments": ""}}]})
+                 + _sse_chunk({"tool_calls": [{"index": 0, "function": {"arguments": "{}"}}]})
+                 + _sse_chunk({}, "tool_calls") + b"data: [DONE]\n\n")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        messages = body["messages"]
+        # questions about time are answered after calling the clock tool
+        call_tool = messages[-1]["role"] == "user" and "time" in messages[-1]["content"]
+        if not call_tool:
+            content = answer
+        else:
+            content = tool_call if "tools" in body else function_call
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=content)
+
+    return httpx.MockTransport(handler)
+
+
+def _build_memory() -> ConversationBufferMemory:
+    return ConversationBufferMemory(memory_key="chat_history", chat_memory=ChatMessageHistory(),
+                                    return_messages=True)
+
+
+def build_langchain_agent(client: AsyncOpenAI):
+    llm = ChatOpenAI(model_name="fake", temperature=0, openai_api_key="fake", streaming=True)
+    llm.async_client = client.chat.completions
+    memory = _build_memory()
+    return Agent._build_agent(llm, memory, [clock, contact_abstracta]), memory
+
+
+def build_native_agent(client: AsyncOpenAI):
+    memory = _build_memory()
+    return NativeAgent(client, "fake", 0, SYSTEM_PROMPT, [clock, contact_abstracta], memory, 3,
+                       tool_dispatcher), memory
+
+
+async def _time_turns(build_agent: Callable, client: AsyncOpenAI, question: str, turns: int) -> float:
+    agent, memory = build_agent(client)
+
+    async def turn() -> None:
+        # the history is cleared so every turn sends the same messages
+        memory.clear()
+        await agent.arun(question, lambda token: None)
+
+    return await _best_time(turn, turns)
+
+
+async def _best_time(turn: Callable[[], Awaitable[None]], turns: int) -> float:
+    # langchain verbose output is part of its overhead, but it is not printed
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(10):
+            await turn()
+        best = float("inf")
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in range(turns):
+                await turn()
+            best = min(best, (time.perf_counter() - start) / turns)
+    return best
+
+
+async def run(turns: int) -> None:
+    print(f"{'benchmark':<24}{'tokens':>8}{'langchain ms':>14}{'native ms':>11}{'speedup':>10}")
+    for tokens in (10, 100, 1000):
+        client = AsyncOpenAI(api_key="fake", base_url="http://fake-model/v1",
+                             http_client=httpx.AsyncClient(transport=build_fake_model(tokens)))
+        for name, question in (("answer", "hello"), ("tool call and answer", "what time is it?")):
+            langchain_time = await _time_turns(build_langchain_agent, client, question, turns)
+            native_time = await _time_turns(build_native_agent, client, question, turns)
+            print(f"{name:<24}{tokens:>8}{langchain_time * 1000:>14.2f}{native_time * 1000:>11.2f}"
+                  f"{langchain_time / native_time:>9.2f}x")
+        await client.close()
+
+
+def main():
+    asyncio.run(run(50))
+
+
+if __name__ == "__main__":
+    main()
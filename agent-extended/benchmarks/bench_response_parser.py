@@ -0,0 +1,132 @@
+"""
+Micro benchmark of agent response parsing comparing the shared single pass parser with the
+previous agent-extended and agent-simple implementations (copied below as reference).
+
+Run from agent-extended folder with: python -m benchmarks.bench_response_parser
+"""
+import re
+import timeit
+from typing import Callable, Dict, List
+
+from gpt_agent.response_parser import StreamingResponseParser, parse_response, replace_placeholders
+
+_BULLET_RE = re.compile(r"^\s*(?:\d+[\.\-\)]|[•\-])\s*", re.MULTILINE)
+_RE_FINAL = re.compile(r"\bRESPUESTA\s+FINAL\s*:\s*", re.I)
+_RE_REASONING = re.compile(r"\bRAZONAMIENTO\s*:\s*", re.I)
+
+
+def legacy_extended_split_numbered_cot(cot_block: str) -> List[str]:
+    lines = cot_block.splitlines()
+    if len(lines) == 1:
+        steps = [s.strip() for s in re.split(r"\.\s+", lines[0]) if s.strip()]
+        return [s if s.endswith(".") else s + "." for s in steps]
+    steps, current = [], []
+    for line in lines:
+        if _BULLET_RE.match(line):
+            if current:
+                steps.append(" ".join(current).strip())
+                current = []
+            line = _BULLET_RE.sub("", line, count=1)
+        current.append(line.strip())
+    if current:
+        steps.append(" ".join(current).strip())
+    return [s for s in steps if s]
+
+
+def legacy_extended_parse(raw_text: str) -> List[dict] | str:
+    lines = raw_text.splitlines()
+    text = "\n".join(line[len("data:"):].strip() if line.startswith("data:") else line for line in lines)
+    if "RAZONAMIENTO:" not in text or "RESPUESTA FINAL:" not in text:
+        return text
+    steps = []
+    parts = _RE_FINAL.split(text, maxsplit=1)
+    if len(parts) == 2:
+        cot_block, final_answer = parts
+        cot_block = _RE_REASONING.sub("", cot_block).strip()
+        for step_text in legacy_extended_split_numbered_cot(cot_block):
+            steps.append({"action": "cot", "value": step_text})
+        steps.append({"action": "final_answer", "value": final_answer.strip()})
+    else:
+        steps.append({"action": "final_answer", "value": text.strip()})
+    return steps
+
+
+def legacy_simple_parse(raw_output: str, observation_map: Dict[str, str]) -> List[dict]:
+    for placeholder, real_value in observation_map.items():
+        if placeholder in raw_output:
+            raw_output = raw_output.replace(placeholder, real_value)
+    steps = []
+    parts = _RE_FINAL.split(raw_output, maxsplit=1)
+    if len(parts) == 2:
+        cot_block, final_answer = parts
+        cot_block = _RE_REASONING.sub("", cot_block).strip()
+        if _BULLET_RE.match(cot_block):
+            steps.extend({"action": "cot", "value": s} for s in legacy_extended_split_numbered_cot(cot_block))
+        elif cot_block:
+            steps.append({"action": "cot", "value": cot_block})
+        steps.append({"action": "final_answer", "value": final_answer.strip()})
+    else:
+        steps.append({"action": "final_answer", "value": raw_output.strip()})
+    return steps
+
+
+def build_response(size: int) -> str:
+    cot = []
+    i = 0
+    while sum(len(c) for c in cot) < size * 2 // 3:
+        i += 1
+        cot.append(f"{i}. Paso número {i} del razonamiento que analiza la pregunta del usuario,\n"
+                   f"   continuando en una segunda línea con más detalles sobre el paso {i}.\n")
+    final = "La respuesta final para el usuario incluye varias oraciones de texto. " * (size // 3 // 70 + 1)
+    return "RAZONAMIENTO:\n" + "".join(cot) + "\nRESPUESTA FINAL:\n" + final
+
+
+def build_observations(count: int) -> Dict[str, str]:
+    return {f"Invoking: `tool_{i}` with `{{}}`": f"observation {i}" for i in range(count)}
+
+
+def stream_parse(text: str, token_size: int = 4) -> list:
+    parser = StreamingResponseParser(dict)
+    ret = []
+    for i in range(0, len(text), token_size):
+        ret.extend(parser.feed(text[i:i + token_size]))
+    ret.extend(parser.finish())
+    return ret
+
+
+def legacy_stream_parse(text: str, token_size: int = 4) -> List[dict] | str:
+    resp = ""
+    for i in range(0, len(text), token_size):
+        resp += text[i:i + token_size]
+    return legacy_extended_parse(resp)
+
+
+def _throughput(func: Callable[[], object], size: int) -> float:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=3, number=number)) / number
+    return size / best / 1024 / 1024
+
+
+def main():
+    observations = build_observations(50)
+    print(f"{'benchmark':<28}{'size':>10}{'legacy MB/s':>14}{'new MB/s':>12}{'speedup':>10}")
+    for size in (10 * 1024, 100 * 1024, 1024 * 1024):
+        text = build_response(size)
+        simple_text = text + "".join(observations)
+        cases = [
+            ("extended complete response", text, lambda: legacy_extended_parse(text),
+             lambda: parse_response(text, dict)),
+            ("simple complete response", simple_text, lambda: legacy_simple_parse(simple_text, observations),
+             lambda: parse_response(replace_placeholders(simple_text, observations), dict)),
+            ("extended token stream", text, lambda: legacy_stream_parse(text), lambda: stream_parse(text)),
+        ]
+        for name, case_text, legacy, new in cases:
+            legacy_speed = _throughput(legacy, len(case_text))
+            new_speed = _throughput(new, len(case_text))
+            print(f"{name:<28}{len(case_text) // 1024:>8}KB{legacy_speed:>14.1f}{new_speed:>12.1f}"
+                  f"{new_speed / legacy_speed:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import asyncio
+import enum
+import heapq
+import itertools
+import os
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+from pydantic import BaseModel
+
+from gpt_agent.cache import LruCache
+
+
+class AdmissionRejectedError(Exception):
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionStats(BaseModel):
+    active: int
+    max_active: int
+    queued: int
+    max_queued: int
+    active_by_priority: Dict[str, int]
+    queued_by_priority: Dict[str, int]
+    admitted: int
+    rate_limited: int
+    rejected: int
+    timed_out: int
+
+
+class _TokenBucket:
+
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token and returns 0, or returns the seconds until a token is available."""
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    def refund(self) -> None:
+        self._tokens = min(self._capacity, self._tokens + 1)
+
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0
+    TRANSCRIPTION = 1
+    BACKGROUND = 2
+
+
+# share of capacity each priority gets, relative to others, when all have waiting work
+_PRIORITY_WEIGHTS = {Priority.INTERACTIVE: 4, Priority.TRANSCRIPTION: 2, Priority.BACKGROUND: 1}
+
+
+class Permit:
+    """Admission to run LLM work, which has to be released once the work ends."""
+
+    def __init__(self, controller: "AdmissionController", priority: Priority):
+        self._controller = controller
+        self._priority = priority
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self._priority)
+
+
+class _Waiter(NamedTuple):
+    tag: float
+    seq: int
+    future: asyncio.Future
+
+
+class AdmissionController:
+    """
+    Limits LLM work running at the same time, and the rate at which each user can start it.
+
+    Each user has a token bucket refilled with `user_rate` tokens per second up to `user_burst`,
+    which is not used by background work. Work exceeding `max_active` waits in a queue up to
+    `queue_timeout` seconds, and it is rejected right away when the user has no tokens or the
+    queue already has `max_queued` entries, so clients can retry later instead of piling up requests.
+
+    Transcriptions and background work can't take more than their `priority_limits`, keeping
+    capacity for interactive questions. Waiting work is scheduled with start time fair queuing: each
+    user and priority is a flow getting a share of capacity proportional to the priority weight, so
+    heavy users or priorities don't delay others.
+    """
+
+    def __init__(self, max_active: int, max_queued: int, queue_timeout: float, user_rate: float, user_burst: float,
+                 priority_limits: Dict[Priority, int], max_users: int = 100000):
+        self._max_active = max_active
+        self._max_queued = max_queued
+        self._queue_timeout = queue_timeout
+        self._user_rate = user_rate
+        self._user_burst = user_burst
+        self._priority_limits = {p: min(priority_limits.get(p, max_active), max_active) for p in Priority}
+        # buckets not used for the time they take to fill up are as good as new ones
+        self._buckets: LruCache[str, _TokenBucket] = LruCache(max_users, ttl=user_burst / user_rate, sliding=True)
+        # finish tag of the last work queued by each flow, flows without queued work are lost on eviction
+        self._flow_tags: LruCache[Tuple[Priority, str], float] = LruCache(max_users)
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._active = 0
+        self._active_by_priority = {p: 0 for p in Priority}
+        self._queues: Dict[Priority, List[_Waiter]] = {p: [] for p in Priority}
+        self._queued = 0
+        self._admitted = 0
+        self._rate_limited = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    async def acquire(self, user: str, priority: Priority = Priority.INTERACTIVE) -> Permit:
+        bucket = None
+        if priority != Priority.BACKGROUND:
+            bucket = self._buckets.get(user)
+            if bucket is None:
+                bucket = _TokenBucket(self._user_rate, self._user_burst)
+                self._buckets.put(user, bucket)
+            wait = bucket.take()
+            if wait:
+                self._rate_limited += 1
+                raise AdmissionRejectedError("rate limit exceeded", wait)
+        try:
+            await self._acquire_slot(user, priority)
+        except AdmissionRejectedError:
+            if bucket:
+                bucket.refund()
+            raise
+        self._admitted += 1
+        return Permit(self, priority)
+
+    async def _acquire_slot(self, user: str, priority: Priority) -> None:
+        if self._queued >= self._max_queued:
+            self._rejected += 1
+            raise AdmissionRejectedError("too many requests in progress", self._queue_timeout)
+        loop = asyncio.get_running_loop()
+        waiter = self._enqueue(user, priority, loop.create_future())
+        self._dispatch()
+        if waiter.done():
+            return
+        timer = loop.call_later(self._queue_timeout, self._expire, waiter)
+        try:
+            # released slots are directly transferred to waiters
+            await waiter
+        except asyncio.CancelledError:
+            self._abandon(waiter, priority)
+            raise
+        finally:
+            timer.cancel()
+
+    def _enqueue(self, user: str, priority: Priority, waiter: asyncio.Future) -> asyncio.Future:
+        flow = (priority, user)
+        tag = max(self._virtual_time, self._flow_tags.get(flow) or 0.0)
+        self._flow_tags.put(flow, tag + 1 / _PRIORITY_WEIGHTS[priority])
+        heapq.heappush(self._queues[priority], _Waiter(tag, next(self._seq), waiter))
+        self._queued += 1
+        return waiter
+
+    def _dispatch(self) -> None:
+        while self._active < self._max_active:
+            next_priority = None
+            for priority, queue in self._queues.items():
+                # cancelled and expired waiters are removed when they get to the head of the queue
+                while queue and queue[0].future.done():
+                    heapq.heappop(queue)
+                if queue and self._active_by_priority[priority] < self._priority_limits[priority] and (
+                        next_priority is None or queue[0] < self._queues[next_priority][0]):
+                    next_priority = priority
+            if next_priority is None:
+                return
+            waiter = heapq.heappop(self._queues[next_priority])
+            self._virtual_time = waiter.tag
+            self._queued -= 1
+            self._active += 1
+            self._active_by_priority[next_priority] += 1
+            waiter.future.set_result(None)
+
+    def _expire(self, waiter: asyncio.Future) -> None:
+        if not waiter.done():
+            self._queued -= 1
+            self._timed_out += 1
+            waiter.set_exception(AdmissionRejectedError("timeout waiting for requests in progress",
+                                                        self._queue_timeout))
+
+    def _abandon(self, waiter: asyncio.Future, priority: Priority) -> None:
+        if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+            # the slot was transferred before the cancellation
+            self._release(priority)
+        elif waiter.cancelled():
+            self._queued -= 1
+
+    def _release(self, priority: Priority) -> None:
+        self._active -= 1
+        self._active_by_priority[priority] -= 1
+        self._dispatch()
+
+    def stats(self) -> AdmissionStats:
+        return AdmissionStats(
+            active=self._active, max_active=self._max_active, queued=self._queued, max_queued=self._max_queued,
+            active_by_priority={p.name.lower(): self._active_by_priority[p] for p in Priority},
+            queued_by_priority={p.name.lower(): sum(1 for w in q if not w.future.done())
+                                for p, q in self._queues.items()},
+            admitted=self._admitted, rate_limited=self._rate_limited, rejected=self._rejected,
+            timed_out=self._timed_out)
+
+
+def _build_priority_limits(max_active: int) -> Dict[Priority, int]:
+    return {
+        Priority.TRANSCRIPTION: int(os.getenv("ADMISSION_TRANSCRIPTION_MAX_ACTIVE", str(max(1, max_active // 4)))),
+        Priority.BACKGROUND: int(os.getenv("ADMISSION_BACKGROUND_MAX_ACTIVE", str(max(1, max_active // 8)))),
+    }
+
+
+_max_active = int(os.getenv("ADMISSION_MAX_ACTIVE", "32"))
+admission_controller = AdmissionController(
+    _max_active,
+    int(os.getenv("ADMISSION_MAX_QUEUED", "64")),
+    float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10")),
+    float(os.getenv("USER_RATE_LIMIT_PER_MINUTE", "20")) / 60,
+    float(os.getenv("USER_RATE_LIMIT_BURST", "5")),
+    _build_priority_limits(_max_active))
@@ -1,32 +1,38 @@
 import asyncio
 import datetime
-import enum
+import functools
 import logging
-import re
 import os
-from typing import List, AsyncIterator, Optional
-from pydantic import BaseModel
+from typing import List, AsyncIterator, Any, Callable, Dict, Optional, Set
 
 from langchain.agents import Tool, OpenAIFunctionsAgent, AgentExecutor
 from langchain.callbacks import AsyncIteratorCallbackHandler
-from langchain.memory import ConversationBufferMemory, FileChatMessageHistory
+from langchain.memory import ConversationBufferMemory
+from langchain.memory.chat_memory import BaseChatMemory
 from langchain.prompts import MessagesPlaceholder
 from langchain.schema import SystemMessage
 from langchain.tools import tool
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.language_models import BaseChatModel
 from langchain_community.chat_models import AzureChatOpenAI, ChatOpenAI
-from openai import OpenAI, AzureOpenAI
-from langchain.callbacks.base import BaseCallbackHandler
-from gpt_agent.domain import Session
+from gpt_agent.clients import client_registry, chat_endpoint
+from gpt_agent.coalescing import response_coalescer
+from gpt_agent.domain import Session, AgentAction, AgentStep, AgentFlow
 from gpt_agent.file_system_repos import get_session_path
+from gpt_agent.memory import RollingSummaryMemory
+from gpt_agent.native_agent import AgentRun, NativeAgent, TokenHandler
+from gpt_agent.response_cache import response_cache, no_response_cache, is_response_cacheable, CachedResponse
+from gpt_agent.response_parser import StreamingResponseParser, parse_response
+from gpt_agent.storage import storage
+from gpt_agent.tool_cache import no_tool_cache
+from gpt_agent.tool_dispatch import tool_dispatcher
 
 logging.getLogger("openai").level = logging.DEBUG
 
-_BULLET_RE = re.compile(r"^\s*(?:\d+[\.\-\)]|[•\-])\s*", re.MULTILINE)
-_RE_FINAL = re.compile(r"\bRESPUESTA\s+FINAL\s*:\s*", re.I)
-_RE_REASONING = re.compile(r"\bRAZONAMIENTO\s*:\s*", re.I)
-
 
 # just a sample tool to showcase how you can create your own set of tools
+@no_response_cache
+@no_tool_cache
 @tool
 def clock() -> str:
     """gets the current time"""
@@ -36,29 +42,6 @@ def clock() -> str:
     )
 
 
-class AgentAction(enum.Enum):
-    MESSAGE = "message"
-    CLICK = "click"
-    FILL = "fill"
-    GOTO = "goto"
-    COT = "cot"
-    FINAL_ANSWER = "final_answer"
-
-
-class AgentStep(BaseModel):
-    action: AgentAction
-    selector: Optional[str] = None
-    value: Optional[str] = None
-
-
-class AgentFlow(BaseModel):
-    steps: List[AgentStep]
-
-    @staticmethod
-    def message(text: str) -> "AgentFlow":
-        return AgentFlow(steps=[AgentStep(action=AgentAction.MESSAGE, value=text)])
-
-
 # a sample tool to showcase how you can automate navigation in the browser
 @tool(return_direct=True)
 def contact_abstracta(full_name: str) -> str:
@@ -114,18 +97,31 @@ class Agent:
 
     def __init__(self, session: Session):
         self._session = session
-        message_history = FileChatMessageHistory(
-            get_session_path(session.id) + "/chat_history.json"
-        )
-        self._memory = ConversationBufferMemory(
+        self._memory = self._build_memory(storage.build_chat_history(session))
+        tools = [clock, contact_abstracta]
+        self._uncacheable_tools = {t.name for t in tools if not is_response_cacheable(t)}
+        if os.getenv("AGENT_ENGINE", "langchain") == "native":
+            self._agent = self._build_native_agent(self._memory, tools)
+        else:
+            self._agent = self._build_agent(self._build_llm(), self._memory, tools)
+
+    def _build_memory(self, message_history: BaseChatMessageHistory) -> BaseChatMemory:
+        if os.getenv("AGENT_MEMORY", "buffer") == "summary":
+            return RollingSummaryMemory(
+                llm=self._build_llm(),
+                chat_memory=message_history,
+                max_token_limit=int(os.getenv("AGENT_MEMORY_MAX_TOKENS", "2000")),
+                summary_path=get_session_path(self._session.id) + "/summary.json",
+                user=self._session.user,
+            )
+        return ConversationBufferMemory(
             memory_key="chat_history", chat_memory=message_history, return_messages=True
         )
-        self._agent = self._build_agent(self._memory, [clock, contact_abstracta])
 
+    @staticmethod
     def _build_agent(
-        self, memory: ConversationBufferMemory, tools: List[Tool]
-    ) -> AgentExecutor:
-        llm = self._build_llm()
+        llm: BaseChatModel, memory: BaseChatMemory, tools: List[Tool]
+    ) -> "_LangchainAgent":
         prompt = OpenAIFunctionsAgent.create_prompt(
             system_message=SystemMessage(content=SYSTEM_PROMPT),
             extra_prompt_messages=[
@@ -133,138 +129,180 @@ class Agent:
             ],
         )
         agent = OpenAIFunctionsAgent(llm=llm, tools=tools, prompt=prompt)
-        return AgentExecutor(
+        return _LangchainAgent(AgentExecutor(
             agent=agent,
             tools=tools,
             memory=memory,
             verbose=True,
             return_intermediate_steps=False,
             max_iterations=int(os.getenv("AGENT_MAX_ITERATIONS", "3")),
+        ))
+
+    @staticmethod
+    def _build_native_agent(memory: BaseChatMemory, tools: List[Tool]) -> NativeAgent:
+        endpoint = chat_endpoint()
+        return NativeAgent(
+            client=client_registry.get_async_client(endpoint),
+            model=endpoint.azure_deployment if endpoint.is_azure else os.getenv("MODEL_NAME"),
+            temperature=float(os.getenv("TEMPERATURE")),
+            system_prompt=SYSTEM_PROMPT,
+            tools=tools,
+            memory=memory,
+            max_iterations=int(os.getenv("AGENT_MAX_ITERATIONS", "3")),
+            dispatcher=tool_dispatcher,
         )
 
-    def _build_llm(self):
+    @staticmethod
+    @functools.cache
+    def _build_llm():
+        # the llm is shared by all agents since it only holds configuration and pooled clients.
+        # Callbacks are provided on each run so there is no per session state in it.
         temperature = float(os.getenv("TEMPERATURE"))
-        base_url = os.getenv("OPENAI_API_BASE")
-        if self._is_azure(base_url):
-            return AzureChatOpenAI(
-                deployment_name=os.getenv("AZURE_DEPLOYMENT_NAME"),
+        endpoint = chat_endpoint()
+        if endpoint.is_azure:
+            ret = AzureChatOpenAI(
+                deployment_name=endpoint.azure_deployment,
                 temperature=temperature,
                 verbose=True,
                 streaming=True,
             )
         else:
-            return ChatOpenAI(
+            ret = ChatOpenAI(
                 model_name=os.getenv("MODEL_NAME"),
                 temperature=temperature,
                 verbose=True,
                 streaming=True,
             )
+        ret.client = client_registry.get_client(endpoint).chat.completions
+        ret.async_client = client_registry.get_async_client(endpoint).chat.completions
+        return ret
 
-    @staticmethod
-    def _is_azure(base_url: str) -> bool:
-        return base_url and ".openai.azure.com" in base_url
+    def reload_history(self) -> None:
+        """Reloads chat history changes made by other processes."""
+        self._memory.chat_memory.refresh()
+
+    async def load_history(self) -> None:
+        """Loads the chat history, which is required before asking or starting the session."""
+        await self._memory.chat_memory.aload()
+
+    async def flush_history(self) -> None:
+        await self._memory.chat_memory.aflush()
 
     def start_session(self):
         self._memory.chat_memory.add_user_message(
             "this is my locale: " + self._session.locales[0]
         )
 
-    def transcript(self, audio_file_path: str) -> str:
-        base_url = os.getenv("OPENAI_WHISPER_API_BASE", os.getenv("OPENAI_API_BASE"))
-        api_key = os.getenv("OPENAI_WHISPER_API_KEY", os.getenv("OPENAI_API_KEY"))
-        api_version = os.getenv(
-            "OPENAI_WHISPER_API_VERSION", os.getenv("OPENAI_API_VERSION")
-        )
-        deployment_name = os.getenv(
-            "AZURE_WHISPER_DEPLOYMENT_NAME", os.getenv("AZURE_DEPLOYMENT_NAME")
-        )
-        client = (
-            AzureOpenAI(
-                azure_endpoint=base_url,
-                api_version=api_version,
-                api_key=api_key,
-                azure_deployment=deployment_name,
-            )
-            if self._is_azure(base_url)
-            else OpenAI(base_url=base_url, api_key=api_key)
-        )
-        locale = self._session.locales[0]
-        lang_separator_pos = locale.find("-")
-        language = locale[0:lang_separator_pos] if lang_separator_pos >= 0 else locale
-        ret = client.audio.transcriptions.create(
-            model="whisper-1", file=open(audio_file_path, "rb"), language=language
-        )
-        return ret.text
-
     async def ask(self, question: str) -> AsyncIterator[AgentFlow | str]:
-        callback = AsyncIteratorCallbackHandler()
-        task = asyncio.create_task(
-            self._agent.arun(input=question, callbacks=[callback])
-        )
+        key = self._build_response_key(question)
+        cached = response_cache.get(key) if key and response_cache.enabled else None
+        if cached:
+            # the conversation is updated as if the agent had answered the question
+            self._memory.save_context({"input": question}, {"output": cached.output})
+            for item in cached.items:
+                yield item
+            return
+        # concurrent identical questions share the same agent run
+        subscription = response_coalescer.subscribe(key, lambda publish: self._run(question, key, publish))
+        items = aiter(subscription)
+        try:
+            async for item in items:
+                yield item
+        finally:
+            # stops the run when no one else is waiting for it
+            await items.aclose()
+            if subscription.leader:
+                # the run stores the question and answer in this session memory, so the session has to
+                # remain in use (and locked) until it ends, even if the client is no longer waiting
+                await subscription.wait_done()
+        if not subscription.leader:
+            self._memory.save_context({"input": question}, {"output": subscription.result})
+
+    async def _run(self, question: str, key: Optional[str], publish: Callable[[AgentFlow | str], None]) -> str:
+        parser = StreamingResponseParser(AgentStep)
         resp = ""
-        async for token in callback.aiter():
+        items = []
+
+        def on_token(token: str) -> None:
+            nonlocal resp
             resp += token
-            # Si querés hacer streaming token a token, aquí puedes hacer yield token
-            # yield token
-        ret = await task
-
-        response_text = ret if ret != resp else resp
-        cleaned_text = Agent.clean_response_text(response_text)
-
-        if "RAZONAMIENTO:" in cleaned_text and "RESPUESTA FINAL:" in cleaned_text:
-            try:
-                pasos = Agent.parse_response_to_actions(cleaned_text)
-                yield AgentFlow(steps=pasos)
-            except Exception as e:
-                logging.exception("Error parsing structured response", exc_info=e)
-                yield cleaned_text
-        else:
-            yield cleaned_text
+            for item in parser.feed(token):
+                items.append(Agent._to_flow(item))
+                publish(items[-1])
 
-    @staticmethod
-    def parse_response_to_actions(text: str) -> List[dict]:
-        steps = []
-        parts = _RE_FINAL.split(text, maxsplit=1)
-        if len(parts) == 2:
-            cot_block, final_answer = parts
-            cot_block = _RE_REASONING.sub("", cot_block).strip()
-            cot_steps = Agent.split_numbered_cot(cot_block)
-            for step_text in cot_steps:
-                steps.append({"action": "cot", "value": step_text})
-            steps.append({"action": "final_answer", "value": final_answer.strip()})
+        ret, used_tools = await self._agent.arun(question, on_token)
+
+        if ret != resp and not parser.emitted:
+            # answers not generated by the llm (eg: tools with return_direct) are not streamed
+            last_items = Agent._parse_complete_response(ret)
         else:
-            steps.append({"action": "final_answer", "value": text.strip()})
-        return steps
+            last_items = [Agent._to_flow(item) for item in parser.finish()]
+        for item in last_items:
+            publish(item)
+        if key and response_cache.enabled and not used_tools & self._uncacheable_tools:
+            response_cache.put(key, CachedResponse(items + last_items, ret))
+        return ret
+
+    def _build_response_key(self, question: str) -> Optional[str]:
+        if not response_cache.enabled and not response_coalescer.enabled:
+            return None
+        llm = self._build_llm()
+        history = self._memory.load_memory_variables({})[self._memory.memory_key]
+        return response_cache.build_key(SYSTEM_PROMPT, history, question,
+                                        getattr(llm, "deployment_name", None) or llm.model_name, llm.temperature)
 
     @staticmethod
-    def split_numbered_cot(cot_block: str) -> List[str]:
-        lines = cot_block.splitlines()
-
-        if len(lines) == 1:
-            # Dividir el único texto por oraciones terminadas en punto y espacio
-            steps = [s.strip() for s in re.split(r"\.\s+", lines[0]) if s.strip()]
-            # Volver a agregar el punto al final de cada oración (excepto la última si ya lo tiene)
-            steps = [s if s.endswith(".") else s + "." for s in steps]
-            return steps
-
-        steps, current = [], []
-        for line in lines:
-            if _BULLET_RE.match(line):
-                if current:
-                    steps.append(" ".join(current).strip())
-                    current = []
-                line = _BULLET_RE.sub("", line, count=1)
-            current.append(line.strip())
-        if current:
-            steps.append(" ".join(current).strip())
-        return [s for s in steps if s]
+    def _to_flow(item: AgentStep | str) -> AgentFlow | str:
+        return AgentFlow(steps=[item]) if isinstance(item, AgentStep) else item
 
     @staticmethod
-    def clean_response_text(raw_text: str) -> str:
-        # Quita los prefijos 'data:' y espacios iniciales
-        lines = raw_text.splitlines()
-        cleaned_lines = [
-            line[len("data:") :].strip() if line.startswith("data:") else line
-            for line in lines
-        ]
-        return "\n".join(cleaned_lines)
+    def _parse_complete_response(response_text: str) -> List[AgentFlow | str]:
+        items = parse_response(response_text, AgentStep)
+        steps = [item for item in items if isinstance(item, AgentStep)]
+        return [AgentFlow(steps=steps)] if steps else items
+
+
+class _LangchainAgent:
+
+    def __init__(self, executor: AgentExecutor):
+        self._executor = executor
+
+    async def arun(self, question: str, on_token: TokenHandler) -> AgentRun:
+        callback = _AgentRunCallbackHandler()
+        task = asyncio.create_task(
+            self._executor.arun(input=question, callbacks=[callback])
+        )
+        task.add_done_callback(lambda _: callback.finish())
+        try:
+            async for token in callback.aiter():
+                on_token(token)
+            return AgentRun(await task, callback.used_tools)
+        finally:
+            task.cancel()
+
+
+class _AgentRunCallbackHandler(AsyncIteratorCallbackHandler):
+    """
+    Streams tokens of all the llm calls made in an agent run, until `finish` is invoked, and keeps
+    track of used tools.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.used_tools: Set[str] = set()
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        self.used_tools.add(serialized.get("name"))
+
+    async def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        pass
+
+    async def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        pass
+
+    def finish(self) -> None:
+        self.queue.put_nowait(None)
+
+    async def aiter(self) -> AsyncIterator[str]:
+        while (token := await self.queue.get()) is not None:
+            yield token
@@ -0,0 +1,51 @@
+import logging
+import os
+import uuid
+
+from gpt_agent.agent import Agent
+from gpt_agent.cache import CacheStats, LruCache
+from gpt_agent.domain import Session
+
+logger = logging.getLogger(__name__)
+
+
+class AgentPool:
+    """
+    Keeps warm `Agent` instances per session so consecutive questions don't rebuild the LLM,
+    prompt, executor and chat history.
+
+    Agents are evicted when the pool exceeds its size (least recently used first) or when a
+    session has been idle for longer than the ttl. Evicted or invalidated agents are only dropped
+    from the pool, so requests already holding them finish normally.
+    """
+
+    def __init__(self, max_size: int, idle_ttl_seconds: float):
+        self._agents: LruCache[uuid.UUID, Agent] = LruCache(
+            max_size, ttl=idle_ttl_seconds, sliding=True, on_evict=self._log_eviction)
+
+    def get(self, session: Session) -> Agent:
+        ret = self._agents.get(session.id)
+        if ret is None:
+            ret = Agent(session)
+            self._agents.put(session.id, ret)
+        return ret
+
+    def __contains__(self, session_id: uuid.UUID) -> bool:
+        return session_id in self._agents
+
+    def invalidate(self, session_id: uuid.UUID) -> None:
+        self._agents.pop(session_id)
+
+    def purge_idle(self) -> int:
+        return self._agents.purge_expired()
+
+    def stats(self) -> CacheStats:
+        return self._agents.stats()
+
+    @staticmethod
+    def _log_eviction(session_id: uuid.UUID, _: Agent) -> None:
+        logger.debug("Evicted agent for session %s", session_id)
+
+
+agent_pool = AgentPool(int(os.getenv("AGENT_POOL_MAX_SIZE", "256")),
+                       float(os.getenv("AGENT_POOL_IDLE_TTL_SECONDS", "900")))
@@ -1,4 +1,7 @@
+import asyncio
+import contextlib
 import logging
+import math
 import os
 import traceback
 from typing import AsyncIterator, Annotated, Optional
@@ -9,10 +12,22 @@ from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from sse_starlette.sse import ServerSentEvent
 
-from gpt_agent.agent import Agent, AgentAction
-from gpt_agent.auth import get_current_user
+from gpt_agent.admission import admission_controller, AdmissionRejectedError, Permit, Priority
+from gpt_agent.agent import AgentAction
+from gpt_agent.agent_pool import agent_pool
+from gpt_agent.auth import get_current_user, start_auth, stop_auth, token_cache_stats
+from gpt_agent.clients import client_registry
+from gpt_agent.coalescing import response_coalescer
 from gpt_agent.domain import Session, Question, TranscriptionQuestion, SessionBase
-from gpt_agent.file_system_repos import SessionsRepository, QuestionsRepository, TranscriptionsRepository
+from gpt_agent.file_system_repos import TranscriptionsRepository, AudioTooLargeError, session_cache_stats
+from gpt_agent.question_writer import question_writer
+from gpt_agent.response_cache import response_cache
+from gpt_agent.retention import retention_job
+from gpt_agent.session_locks import session_locks
+from gpt_agent.storage import storage
+from gpt_agent.tool_cache import tool_result_cache
+from gpt_agent.tool_dispatch import tool_dispatcher
+from gpt_agent.transcription import transcriber
 
 logging.basicConfig()
 logger = logging.getLogger("gpt_agent")
@@ -22,9 +37,68 @@ logging.getLogger().level = logging.DEBUG
 app = FastAPI()
 assets_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'assets')
 templates = Jinja2Templates(directory=assets_path)
-sessions_repo = SessionsRepository()
-questions_repo = QuestionsRepository()
 transcriptions_repo = TranscriptionsRepository()
+max_audio_size = int(os.getenv("TRANSCRIPTION_MAX_BYTES", str(25 * 1024 * 1024)))
+max_session_queued_questions = int(os.getenv("SESSION_MAX_QUEUED_QUESTIONS", "4"))
+background_tasks = set()
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    await start_auth()
+    await storage.start()
+    question_writer.start()
+    background_tasks.add(asyncio.create_task(_purge_idle_agents()))
+    if retention_job.enabled:
+        background_tasks.add(asyncio.create_task(_run_retention()))
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for task in background_tasks:
+        task.cancel()
+    await stop_auth()
+    await question_writer.stop()
+    await storage.stop()
+    await client_registry.aclose()
+    tool_dispatcher.close()
+
+
+async def _purge_idle_agents():
+    period = float(os.getenv("AGENT_POOL_PURGE_PERIOD_SECONDS", "60"))
+    while True:
+        await asyncio.sleep(period)
+        try:
+            agent_pool.purge_idle()
+        except Exception as e:
+            logger.exception("Problem purging idle agents", exc_info=e)
+
+
+async def _run_retention():
+    period = float(os.getenv("RETENTION_PERIOD_SECONDS", "3600"))
+    while True:
+        try:
+            await retention_job.run()
+        except Exception as e:
+            logger.exception("Problem applying sessions retention", exc_info=e)
+        await asyncio.sleep(period)
+
+
+@app.get('/metrics')
+async def get_metrics() -> dict:
+    return {
+        "agent_pool": agent_pool.stats().model_dump(),
+        "admission": admission_controller.stats().model_dump(),
+        "token_cache": token_cache_stats().model_dump(),
+        "session_cache": session_cache_stats().model_dump(),
+        "question_writer": question_writer.stats().model_dump(),
+        "retention": retention_job.stats().model_dump(),
+        "response_cache": response_cache.stats().model_dump(),
+        "response_coalescer": response_coalescer.stats().model_dump(),
+        "session_locks": session_locks.stats().model_dump(),
+        "tool_dispatcher": tool_dispatcher.stats().model_dump(),
+        "tool_cache": tool_result_cache.stats().model_dump(),
+    }
 
 
 @app.get('/manifest.json')
@@ -46,8 +120,10 @@ async def get_logo() -> FileResponse:
 @app.post('/sessions', status_code=status.HTTP_201_CREATED)
 async def create_session(req: SessionBase, user: Annotated[str, Depends(get_current_user)]) -> Session:
     ret = Session(**req.model_dump(), user=user)
-    await sessions_repo.save_session(ret)
-    Agent(ret).start_session()
+    await storage.save_session(ret)
+    agent = agent_pool.get(ret)
+    await agent.load_history()
+    agent.start_session()
     return ret
 
 
@@ -56,38 +132,92 @@ class QuestionRequest(BaseModel):
 
 
 @app.post('/sessions/{session_id}/questions')
-async def answer_question(
-        session_id: str, req: QuestionRequest, user: Annotated[str, Depends(get_current_user)]) -> StreamingResponse:
+async def answer_question(session_id: str, req: QuestionRequest, request: Request,
+                          user: Annotated[str, Depends(get_current_user)]) -> StreamingResponse:
     session = await _find_session(session_id, user)
+    resources = contextlib.AsyncExitStack()
+    try:
+        # questions of a session are answered one at a time, in order, so they see previous answers.
+        # Admission is requested once the session is free, so waiting questions don't take admission slots
+        await resources.enter_async_context(_lock_session(session))
+        resources.callback((await _admit(user, request)).release)
+    except BaseException:
+        await resources.aclose()
+        raise
     # This copilot uses response streaming which allows users to start get a response as soon as
     # possible, which is particularly important when interacting with LLMs that support response
     # streaming and may take some time to end answering a given response.
     # If you don't want to use response streaming you can just return a pydantic object like in
     # create session endpoint.
-    return StreamingResponse(agent_response_stream(req, session), media_type="text/event-stream")
+    return _ClosingStreamingResponse(agent_response_stream(req, session), resources, media_type="text/event-stream")
 
 
 async def _find_session(session_id: str, user: str) -> Session:
-    ret = await sessions_repo.find_session(session_id)
+    ret = await storage.find_session(session_id)
     if not ret or ret.user != user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f'session {session_id} not found')
     return ret
 
 
+def _lock_session(session: Session) -> contextlib.AbstractAsyncContextManager:
+    if session_locks.queued_questions(session.id) >= max_session_queued_questions:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail="too many questions in progress in the session")
+    return session_locks.lock(session.id)
+
+
+async def _admit(user: str, request: Request, priority: Priority = Priority.INTERACTIVE) -> Permit:
+    # without authentication all users are anonymous, so they are told apart by their address
+    if not user and request.client:
+        user = f"client:{request.client.host}"
+    try:
+        return await admission_controller.acquire(user, priority)
+    except AdmissionRejectedError as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e),
+                            headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+
+class _ClosingStreamingResponse(StreamingResponse):
+    """
+    Closes the content, and then the given resources (session lock and admission permit), once the
+    response ends, even if the client disconnects before it starts.
+    """
+
+    def __init__(self, content: AsyncIterator[bytes], resources: contextlib.AsyncExitStack, **kwargs):
+        super().__init__(content, **kwargs)
+        self._resources = resources
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                # the content is not closed when the client disconnects, and it has to end while the session is locked
+                await self.body_iterator.aclose()
+            finally:
+                await self._resources.aclose()
+
+
 async def agent_response_stream(req: QuestionRequest, session: Session) -> AsyncIterator[bytes]:
     try:
-        answer_stream = Agent(session).ask(req.question)
+        agent = agent_pool.get(session)
+        if session_locks.cross_process:
+            agent.reload_history()
+        await agent.load_history()
         complete_answer = ""
-        async for token in answer_stream:
-            if isinstance(token, str):
-                complete_answer = complete_answer + token
-                yield ServerSentEvent(data=token).encode()
-            else:
-                complete_answer = complete_answer + token.model_dump_json()
-                yield ServerSentEvent(event="flow", data=token.model_dump_json()).encode()
+        async with contextlib.aclosing(agent.ask(req.question)) as answer_stream:
+            async for token in answer_stream:
+                if isinstance(token, str):
+                    complete_answer = complete_answer + token
+                    yield ServerSentEvent(data=token).encode()
+                else:
+                    complete_answer = complete_answer + token.model_dump_json()
+                    yield ServerSentEvent(event="flow", data=token.model_dump_json()).encode()
+        if session_locks.cross_process:
+            await agent.flush_history()
         ret = Question(question=req.question, answer=complete_answer, session=session)
-        await questions_repo.save_question(ret)
+        await question_writer.put(ret)
     except Exception as e:
         traceback.print_exception(e)
         yield ServerSentEvent(event="error").encode()
@@ -102,9 +232,37 @@ class TranscriptionResponse(BaseModel):
 
 
 @app.post('/sessions/{session_id}/transcriptions')
-async def answer_transcription(session_id: str, req: TranscriptionRequest, user: Annotated[str, Depends(get_current_user)]) -> TranscriptionResponse:
+async def answer_transcription(session_id: str, req: TranscriptionRequest, request: Request, user: Annotated[str, Depends(get_current_user)]) -> TranscriptionResponse:
+    session = await _find_session(session_id, user)
+    permit = await _admit(user, request, Priority.TRANSCRIPTION)
+    try:
+        ret = TranscriptionQuestion(base64=req.file, session=session)
+        audio_file_path = await transcriptions_repo.save_audio(ret)
+        text = await transcriber.transcript(session, audio_file_path)
+    finally:
+        permit.release()
+    return TranscriptionResponse(text=text)
+
+
+@app.post('/sessions/{session_id}/transcriptions/audio')
+async def answer_audio_transcription(session_id: str, request: Request, user: Annotated[str, Depends(get_current_user)]) -> TranscriptionResponse:
+    # Receives the raw audio as request body, and stores it while it is being received, avoiding
+    # base64 encoding and keeping the entire audio in memory.
     session = await _find_session(session_id, user)
-    ret = TranscriptionQuestion(base64=req.file, session=session)
-    audio_file_path = await transcriptions_repo.save_audio(ret)
-    text = Agent(session).transcript(audio_file_path)
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > max_audio_size:
+        raise _build_audio_too_large_exception()
+    permit = await _admit(user, request, Priority.TRANSCRIPTION)
+    try:
+        audio_file_path = await transcriptions_repo.save_audio_stream(request.stream(), max_audio_size, session)
+        text = await transcriber.transcript(session, audio_file_path)
+    except AudioTooLargeError:
+        raise _build_audio_too_large_exception()
+    finally:
+        permit.release()
     return TranscriptionResponse(text=text)
+
+
+def _build_audio_too_large_exception() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                         detail=f'audio exceeds {max_audio_size} bytes')
@@ -1,15 +1,25 @@
+import asyncio
 import datetime
+import hashlib
+import logging
 import os
+import time
 import traceback
-from typing import Optional, Annotated, Any
+from typing import NamedTuple, Optional, Annotated, Dict
 
-import requests
+import httpx
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OpenIdConnect
 from fastapi.security.utils import get_authorization_scheme_param
-from jose import JWTError, jwt
+from jose import JWTError, jwk, jwt
+from jose.exceptions import JOSEError
+from jose.backends.base import Key
 from starlette.requests import Request
 
+from gpt_agent.cache import CacheStats, LruCache
+
+logger = logging.getLogger(__name__)
+
 
 def _build_auth_exception() -> HTTPException:
     return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, headers={"WWW-Authenticate": "Bearer"})
@@ -25,52 +35,165 @@ class BearerOpenIdConnect(OpenIdConnect):
         return param
 
 
-class OpenIdConfig:
+class SigningKey(NamedTuple):
+    key: Key
+    # algorithm of the key, as published by the provider, which tokens have to be signed with
+    algorithm: str
 
-    def __init__(self, url: str):
-        self.url = url
-        self._last_update = None
-        self._keys = None
 
-    def get_updated_keys(self, period: datetime.timedelta) -> Any:
-        if self._last_update is None or datetime.datetime.utcnow() - self._last_update > period:
-            self._update_keys()
-        return self._keys
+# algorithms of keys not specifying one, by key type and curve
+_DEFAULT_KEY_ALGORITHMS = {("RSA", None): "RS256", ("EC", "P-256"): "ES256", ("EC", "P-384"): "ES384",
+                           ("EC", "P-521"): "ES512"}
+
 
-    def _update_keys(self):
-        self.keys_last_update = datetime.datetime.utcnow()
-        config_resp = requests.get(self.url)
-        ret_resp = requests.get(config_resp.json()['jwks_uri'])
-        self._keys = ret_resp.json()
+class OpenIdConfig:
+    """
+    Keeps OpenID signing keys (JWKS) indexed by key id, so tokens can be verified without network
+    requests.
+
+    Keys are loaded on startup and refreshed in the background before they expire. Tokens signed
+    with an unknown key trigger an on demand refresh, limited to one in flight and one every
+    `unknown_key_refresh_period`.
+    """
+
+    def __init__(self, url: str, keys_ttl: datetime.timedelta, unknown_key_refresh_period: datetime.timedelta):
+        self.url = url
+        self._keys_ttl = keys_ttl
+        self._unknown_key_refresh_period = unknown_key_refresh_period
+        self._last_update: Optional[float] = None
+        self._keys: Dict[Optional[str], dict] = {}
+        self._constructed_keys: Dict[Optional[str], SigningKey] = {}
+        self._update_task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        try:
+            await self.update_keys()
+        except Exception as e:
+            logger.exception("Problem loading OpenID keys, retrying on demand", exc_info=e)
+        self._refresh_task = asyncio.create_task(self._refresh_keys_periodically())
+
+    async def stop(self) -> None:
+        if self._refresh_task:
+            self._refresh_task.cancel()
+
+    async def _refresh_keys_periodically(self) -> None:
+        period = self._keys_ttl.total_seconds() * 0.8
+        retry_period = min(60.0, period)
+        while True:
+            await asyncio.sleep(period if self._keys else retry_period)
+            try:
+                await self.update_keys()
+            except Exception as e:
+                logger.exception("Problem refreshing OpenID keys", exc_info=e)
+
+    async def get_key(self, kid: Optional[str]) -> Optional[SigningKey]:
+        if kid not in self._keys and self._can_refresh_for_unknown_key():
+            try:
+                await self.update_keys()
+            except Exception as e:
+                logger.exception("Problem refreshing OpenID keys", exc_info=e)
+        key = self._keys.get(kid)
+        if key is None:
+            return None
+        ret = self._constructed_keys.get(kid)
+        if ret is None:
+            # the algorithm comes from the key and never from the unverified token
+            alg = key.get("alg") or _DEFAULT_KEY_ALGORITHMS.get((key.get("kty"), key.get("crv")))
+            if alg is None:
+                raise JWTError(f"unsupported signing key {kid}")
+            try:
+                ret = SigningKey(jwk.construct(key, alg), alg)
+            except JOSEError as e:
+                raise JWTError(f"invalid signing key {kid}: {e}") from e
+            self._constructed_keys[kid] = ret
+        return ret
+
+    def _can_refresh_for_unknown_key(self) -> bool:
+        return (self._last_update is None
+                or time.monotonic() - self._last_update > self._unknown_key_refresh_period.total_seconds())
+
+    async def update_keys(self) -> None:
+        # single flight: concurrent requests wait for the update already in progress
+        if self._update_task is None or self._update_task.done():
+            self._update_task = asyncio.create_task(self._update_keys())
+        await asyncio.shield(self._update_task)
+
+    async def _update_keys(self) -> None:
+        self._last_update = time.monotonic()
+        async with httpx.AsyncClient() as client:
+            config_resp = await client.get(self.url)
+            config_resp.raise_for_status()
+            ret_resp = await client.get(config_resp.json()['jwks_uri'])
+            ret_resp.raise_for_status()
+        keys = [k for k in ret_resp.json()['keys'] if k.get('use', 'sig') == 'sig']
+        self._keys = {k.get('kid'): k for k in keys}
+        self._constructed_keys = {}
 
 
 openid_url = os.getenv("OPENID_URL")
 if openid_url is not None:
     config_url = openid_url + "/.well-known/openid-configuration"
-    openid_config = OpenIdConfig(config_url)
+    openid_config = OpenIdConfig(
+        config_url,
+        keys_ttl=datetime.timedelta(seconds=int(os.getenv("OPENID_KEYS_TTL_SECONDS", "86400"))),
+        unknown_key_refresh_period=datetime.timedelta(minutes=5))
     auth_scheme = BearerOpenIdConnect(openIdConnectUrl=config_url)
 else:
     openid_config = None
     auth_scheme = lambda: None
 
 
-def _decode_token(token: str) -> dict:
-    openid_keys = openid_config.get_updated_keys(datetime.timedelta(days=1))
-    options = {"verify_aud": False}
-    try:
-        return jwt.decode(token, openid_keys, options=options)
-    except JWTError as e:
-        new_keys = openid_config.get_updated_keys(datetime.timedelta(minutes=5))
-        if new_keys == openid_keys:
-            raise e
-        return jwt.decode(token, new_keys, options=options)
+async def start_auth() -> None:
+    if openid_config is not None:
+        await openid_config.start()
+
+
+async def stop_auth() -> None:
+    if openid_config is not None:
+        await openid_config.stop()
+
+
+# verified tokens are cached, until they expire, by their digest to avoid verifying signatures of
+# the same token on each request of a session
+_verified_tokens: LruCache[bytes, dict] = LruCache(int(os.getenv("TOKEN_CACHE_MAX_SIZE", "1024")))
+_UNEXPIRING_TOKEN_CACHE_SECONDS = 300
+
+
+async def _decode_token(token: str) -> dict:
+    digest = hashlib.sha256(token.encode()).digest()
+    ret = _verified_tokens.get(digest)
+    if ret is None:
+        ret = await _verify_token(token)
+        _verified_tokens.put(digest, ret, expires_at=_build_cache_deadline(ret))
+    return ret
+
+
+async def _verify_token(token: str) -> dict:
+    header = jwt.get_unverified_header(token)
+    key = await openid_config.get_key(header.get("kid"))
+    if key is None:
+        raise JWTError(f"unknown signing key {header.get('kid')}")
+    return jwt.decode(token, key.key, algorithms=[key.algorithm], options={"verify_aud": False})
+
+
+def _build_cache_deadline(claims: dict) -> float:
+    ttl = _UNEXPIRING_TOKEN_CACHE_SECONDS
+    exp = claims.get("exp")
+    if isinstance(exp, (int, float)):
+        ttl = exp - time.time()
+    return time.monotonic() + ttl
+
+
+def token_cache_stats() -> CacheStats:
+    return _verified_tokens.stats()
 
 
 async def get_current_user(token: Annotated[Optional[str], Depends(auth_scheme)]) -> str:
     if openid_url is None:
         return ""
     try:
-        payload = _decode_token(token)
+        payload = await _decode_token(token)
         username = payload.get("email")
         # In Azure Authentication we haven't been able to get email attribute, but it is contained
         # in this attribute
@@ -79,6 +202,6 @@ async def get_current_user(token: Annotated[Optional[str], Depends(auth_scheme)]
         if username is None:
             raise _build_auth_exception()
         return username
-    except JWTError as e:
+    except JOSEError as e:
         traceback.print_exception(e)
         raise _build_auth_exception()
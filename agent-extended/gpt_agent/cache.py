@@ -0,0 +1,102 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+from pydantic import BaseModel, computed_field
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class CacheStats(BaseModel):
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    evictions: int
+
+    @computed_field
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class LruCache(Generic[K, V]):
+    """
+    Bounded LRU cache with optional expiration.
+
+    Entries expire `ttl` seconds after they were stored, or after they were last read when
+    `sliding` is set (idle expiration). A per entry expiration can also be given on `put`.
+    `on_evict` is invoked for entries removed due to size or expiration, but not for entries
+    explicitly removed with `pop` or `clear`.
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None, sliding: bool = False,
+                 on_evict: Optional[Callable[[K, V], None]] = None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._sliding = sliding
+        self._on_evict = on_evict
+        self._entries: OrderedDict[K, Tuple[V, Optional[float]]] = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and not self._is_expired(entry, time.monotonic())
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is None or self._is_expired(entry, now):
+            if entry is not None:
+                self._evict(key)
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(key)
+        if self._sliding and self._ttl is not None:
+            self._entries[key] = (entry[0], now + self._ttl)
+        return entry[0]
+
+    def put(self, key: K, value: V, expires_at: Optional[float] = None) -> None:
+        """Stores a value. `expires_at` is a `time.monotonic()` deadline overriding the ttl."""
+        if expires_at is None and self._ttl is not None:
+            expires_at = time.monotonic() + self._ttl
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._evict(next(iter(self._entries)))
+
+    def pop(self, key: K) -> Optional[V]:
+        entry = self._entries.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def purge_expired(self) -> int:
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if self._is_expired(entry, now)]
+        for key in expired:
+            self._evict(key)
+        return len(expired)
+
+    def stats(self) -> CacheStats:
+        return CacheStats(size=len(self._entries), max_size=self._max_size, hits=self._hits,
+                          misses=self._misses, evictions=self._evictions)
+
+    @staticmethod
+    def _is_expired(entry: Tuple[V, Optional[float]], now: float) -> bool:
+        return entry[1] is not None and entry[1] <= now
+
+    def _evict(self, key: K) -> None:
+        value, _ = self._entries.pop(key)
+        self._evictions += 1
+        if self._on_evict:
+            self._on_evict(key, value)
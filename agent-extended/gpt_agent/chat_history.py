@@ -0,0 +1,212 @@
+import asyncio
+import json
+import logging
+import os
+from typing import List, Optional
+
+import aiofiles
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+logger = logging.getLogger(__name__)
+
+_CLEAR_RECORD = json.dumps({"type": "clear"})
+
+
+class JsonlChatMessageHistory(BaseChatMessageHistory):
+    """
+    Chat message history stored as one JSON line per message.
+
+    Adding a message only appends its line to the file (from a background task when there is a
+    running event loop), so the cost of each turn doesn't depend on the conversation length.
+    Clearing the history appends a clear record, and lines invalidated this way are dropped by
+    compacting the file in the background once they exceed `compact_threshold`.
+    An index with the offset of each live line is kept so the last messages can be read without
+    parsing the entire file. The index and messages are loaded by `aload` in a worker thread, which
+    is required before using the history from the event loop.
+    """
+
+    def __init__(self, file_path: str, compact_threshold: int = 100):
+        self._file_path = file_path
+        self._compact_threshold = compact_threshold
+        self._offsets: List[int] = []
+        self._size = 0
+        self._dead_lines = 0
+        self._messages: Optional[List[BaseMessage]] = None
+        self._pending: List[str] = []
+        self._writing: List[str] = []
+        self._writer: Optional[asyncio.Task] = None
+        self._indexed = False
+        # the file might have been changed by other processes since it was indexed
+        self._stale = False
+
+    def _import_legacy_history(self) -> None:
+        legacy_path = os.path.splitext(self._file_path)[0] + ".json"
+        if not os.path.exists(legacy_path):
+            return
+        with open(legacy_path) as f:
+            items = json.loads(f.read() or "[]")
+        with open(self._file_path, "w") as f:
+            f.writelines(json.dumps(item) + "\n" for item in items)
+
+    def _load_index(self) -> None:
+        if self._stale and os.path.exists(self._file_path) and os.path.getsize(self._file_path) != self._size:
+            self._indexed = False
+        self._stale = False
+        if self._indexed:
+            return
+        self._offsets, self._size, self._dead_lines, self._messages = [], 0, 0, None
+        if not os.path.exists(self._file_path):
+            self._import_legacy_history()
+        self._load_offsets()
+        self._indexed = True
+
+    def _ensure_index(self) -> None:
+        if self._indexed and not self._stale:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._load_index()
+            return
+        raise RuntimeError(f"Chat history {self._file_path} used before loading it with aload")
+
+    def _load_offsets(self) -> None:
+        if not os.path.exists(self._file_path):
+            return
+        with open(self._file_path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.rstrip() == _CLEAR_RECORD.encode():
+                    self._dead_lines += len(self._offsets) + 1
+                    self._offsets = []
+                elif line.strip():
+                    self._offsets.append(offset)
+                offset += len(line)
+            self._size = offset
+
+    def refresh(self) -> None:
+        """Makes the next `aload` reload the history if the file was changed by another process."""
+        if not self._pending and not self._writing:
+            self._stale = True
+
+    async def aload(self) -> None:
+        await self.aflush()
+        if not self._indexed or self._stale or self._messages is None:
+            await asyncio.to_thread(self._load)
+
+    def _load(self) -> None:
+        self._load_index()
+        if self._messages is None:
+            self._messages = self._read_messages(self._offsets) + self._unwritten_messages()
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore
+        self._ensure_index()
+        if self._messages is None:
+            self._messages = self._read_messages(self._offsets) + self._unwritten_messages()
+        return list(self._messages)
+
+    def tail(self, count: int) -> List[BaseMessage]:
+        if count <= 0:
+            return []
+        self._ensure_index()
+        if self._messages is None:
+            return (self._read_messages(self._offsets[-count:]) + self._unwritten_messages())[-count:]
+        return self._messages[-count:]
+
+    def _read_messages(self, offsets: List[int]) -> List[BaseMessage]:
+        if not offsets:
+            return []
+        with open(self._file_path, "rb") as f:
+            f.seek(offsets[0])
+            # only read indexed lines, ignoring any line that might be currently being written
+            lines = f.read(self._size - offsets[0]).splitlines()
+        return messages_from_dict([json.loads(line) for line in lines if line.strip()])
+
+    def _unwritten_messages(self) -> List[BaseMessage]:
+        lines = self._writing + self._pending
+        return messages_from_dict([json.loads(line) for line in lines if line != _CLEAR_RECORD])
+
+    def add_message(self, message: BaseMessage) -> None:
+        # the file is indexed, and legacy history imported, before adding lines to it
+        self._ensure_index()
+        if self._messages is not None:
+            self._messages.append(message)
+        self._append(json.dumps(message_to_dict(message)))
+
+    async def aadd_message(self, message: BaseMessage) -> None:
+        self.add_message(message)
+        await self.aflush()
+
+    def clear(self) -> None:
+        self._ensure_index()
+        self._messages = []
+        self._append(_CLEAR_RECORD)
+
+    def _append(self, line: str) -> None:
+        self._pending.append(line)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_pending()
+            return
+        if self._writer is None or self._writer.done():
+            self._writer = loop.create_task(self._write_pending_async())
+
+    def _write_pending(self) -> None:
+        self._writing = self._take_pending()
+        with open(self._file_path, "a") as f:
+            f.write("".join(line + "\n" for line in self._writing))
+        self._index_written()
+        if self._needs_compaction():
+            self._compact()
+
+    async def _write_pending_async(self) -> None:
+        try:
+            while self._pending:
+                self._writing = self._take_pending()
+                async with aiofiles.open(self._file_path, "a") as f:
+                    await f.write("".join(line + "\n" for line in self._writing))
+                self._index_written()
+                if self._needs_compaction():
+                    await asyncio.to_thread(self._compact)
+        except Exception as e:
+            logger.exception("Problem writing chat history %s", self._file_path, exc_info=e)
+
+    def _take_pending(self) -> List[str]:
+        ret, self._pending = self._pending, []
+        return ret
+
+    def _index_written(self) -> None:
+        lines, self._writing = self._writing, []
+        for line in lines:
+            if line == _CLEAR_RECORD:
+                self._dead_lines += len(self._offsets) + 1
+                self._offsets = []
+            else:
+                self._offsets.append(self._size)
+            self._size += len(line.encode()) + 1
+
+    def _needs_compaction(self) -> bool:
+        return self._dead_lines >= self._compact_threshold
+
+    def _compact(self) -> None:
+        tmp_path = self._file_path + ".tmp"
+        with open(self._file_path, "rb") as src, open(tmp_path, "wb") as dst:
+            offsets = []
+            if self._offsets:
+                src.seek(self._offsets[0])
+                for line in src.read(self._size - self._offsets[0]).splitlines(keepends=True):
+                    if line.strip() and line.rstrip() != _CLEAR_RECORD.encode():
+                        offsets.append(dst.tell())
+                        dst.write(line)
+            size = dst.tell()
+        os.replace(tmp_path, self._file_path)
+        self._offsets = offsets
+        self._size = size
+        self._dead_lines = 0
+
+    async def aflush(self) -> None:
+        while self._writer is not None and not self._writer.done():
+            await self._writer
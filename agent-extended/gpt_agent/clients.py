@@ -0,0 +1,100 @@
+import os
+import threading
+from typing import Dict, NamedTuple, Optional
+
+import httpx
+from openai import AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, OpenAI
+
+
+class ClientEndpoint(NamedTuple):
+    base_url: Optional[str]
+    api_key: Optional[str]
+    api_version: Optional[str] = None
+    azure_deployment: Optional[str] = None
+
+    @property
+    def is_azure(self) -> bool:
+        return is_azure(self.base_url)
+
+
+def is_azure(base_url: Optional[str]) -> bool:
+    return bool(base_url) and ".openai.azure.com" in base_url
+
+
+def chat_endpoint() -> ClientEndpoint:
+    return ClientEndpoint(
+        base_url=os.getenv("OPENAI_API_BASE"),
+        api_key=os.getenv("OPENAI_API_KEY"),
+        api_version=os.getenv("OPENAI_API_VERSION"),
+        azure_deployment=os.getenv("AZURE_DEPLOYMENT_NAME"))
+
+
+def whisper_endpoint() -> ClientEndpoint:
+    return ClientEndpoint(
+        base_url=os.getenv("OPENAI_WHISPER_API_BASE", os.getenv("OPENAI_API_BASE")),
+        api_key=os.getenv("OPENAI_WHISPER_API_KEY", os.getenv("OPENAI_API_KEY")),
+        api_version=os.getenv("OPENAI_WHISPER_API_VERSION", os.getenv("OPENAI_API_VERSION")),
+        azure_deployment=os.getenv("AZURE_WHISPER_DEPLOYMENT_NAME", os.getenv("AZURE_DEPLOYMENT_NAME")))
+
+
+def _build_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("OPENAI_HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("OPENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        keepalive_expiry=float(os.getenv("OPENAI_HTTP_KEEPALIVE_EXPIRY_SECONDS", "60")))
+
+
+class ClientRegistry:
+    """
+    Process wide OpenAI clients, one per endpoint, each one with its own HTTP connection pool so
+    requests from all sessions reuse established (keep-alive) connections to the provider.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._async_clients: Dict[ClientEndpoint, AsyncOpenAI] = {}
+        self._sync_clients: Dict[ClientEndpoint, OpenAI] = {}
+
+    def get_async_client(self, endpoint: ClientEndpoint) -> AsyncOpenAI:
+        with self._lock:
+            ret = self._async_clients.get(endpoint)
+            if ret is None:
+                ret = self._build_client(endpoint, AsyncAzureOpenAI, AsyncOpenAI,
+                                         httpx.AsyncClient(limits=_build_limits()))
+                self._async_clients[endpoint] = ret
+            return ret
+
+    def get_client(self, endpoint: ClientEndpoint) -> OpenAI:
+        with self._lock:
+            ret = self._sync_clients.get(endpoint)
+            if ret is None:
+                ret = self._build_client(endpoint, AzureOpenAI, OpenAI,
+                                         httpx.Client(limits=_build_limits()))
+                self._sync_clients[endpoint] = ret
+            return ret
+
+    @staticmethod
+    def _build_client(endpoint: ClientEndpoint, azure_class, openai_class, http_client):
+        if endpoint.is_azure:
+            return azure_class(
+                azure_endpoint=endpoint.base_url,
+                api_version=endpoint.api_version,
+                api_key=endpoint.api_key,
+                azure_deployment=endpoint.azure_deployment,
+                http_client=http_client)
+        return openai_class(base_url=endpoint.base_url, api_key=endpoint.api_key,
+                            http_client=http_client)
+
+    async def aclose(self) -> None:
+        with self._lock:
+            async_clients = list(self._async_clients.values())
+            sync_clients = list(self._sync_clients.values())
+            self._async_clients.clear()
+            self._sync_clients.clear()
+        for client in async_clients:
+            await client.close()
+        for client in sync_clients:
+            client.close()
+
+
+client_registry = ClientRegistry()
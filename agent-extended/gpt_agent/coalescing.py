@@ -0,0 +1,149 @@
+import asyncio
+import os
+from typing import AsyncIterator, Awaitable, Callable, Dict, Generic, List, Optional, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+Publisher = Callable[[T], None]
+Producer = Callable[[Publisher], Awaitable[R]]
+
+
+class CoalescerStats(BaseModel):
+    in_flight: int
+    started: int
+    joined: int
+    cancelled: int
+
+
+class _Flight(Generic[T, R]):
+
+    def __init__(self, key: Optional[str], producer: Producer, on_done: Callable[["_Flight"], None]):
+        self.key = key
+        self.items: List[T] = []
+        self.result: Optional[R] = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._on_done = on_done
+        self.task = asyncio.create_task(self._run(producer))
+
+    async def _run(self, producer: Producer) -> None:
+        try:
+            self.result = await producer(self._publish)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            self._on_done(self)
+
+    def _publish(self, item: T) -> None:
+        self.items.append(item)
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_change(self, seen: int) -> None:
+        if len(self.items) == seen and not self.done:
+            await self._changed.wait()
+
+
+class Subscription(Generic[T, R]):
+    """
+    Items published by a producer, from the first one, no matter when the subscription was made.
+    Iterating the subscription raises any error raised by the producer.
+    """
+
+    def __init__(self, flight: _Flight[T, R], leader: bool, on_close: Callable[[_Flight], None]):
+        self._flight = flight
+        self.leader = leader
+        self._on_close = on_close
+        flight.subscribers += 1
+
+    @property
+    def result(self) -> Optional[R]:
+        return self._flight.result
+
+    async def wait_done(self) -> None:
+        """
+        Waits for the producer to end, even if the waiting task is cancelled meanwhile, in which case
+        the cancellation is raised once the producer ends.
+        """
+        task = self._flight.task
+        cancelled = False
+        while not task.done():
+            try:
+                # unlike awaiting the task, waiting for it doesn't cancel it when this task is cancelled
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                cancelled = True
+        if cancelled:
+            raise asyncio.CancelledError()
+
+    async def __aiter__(self) -> AsyncIterator[T]:
+        flight = self._flight
+        seen = 0
+        try:
+            while True:
+                while seen < len(flight.items):
+                    yield flight.items[seen]
+                    seen += 1
+                if flight.done:
+                    break
+                await flight.wait_change(seen)
+            if flight.error:
+                raise flight.error
+        finally:
+            self._on_close(flight)
+
+
+class Coalescer:
+    """
+    Shares a single execution of a producer between concurrent subscriptions with the same key.
+
+    The producer runs in its own task publishing items that are fanned out to all subscribers, and
+    it is cancelled when all subscribers stop iterating (eg: clients disconnecting) before it ends.
+    Subscriptions without key or made while disabled always start a new producer.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._flights: Dict[str, _Flight] = {}
+        self._started = 0
+        self._joined = 0
+        self._cancelled = 0
+
+    def subscribe(self, key: Optional[str], producer: Producer) -> Subscription:
+        flight = self._flights.get(key) if key else None
+        if flight:
+            self._joined += 1
+            return Subscription(flight, False, self._unsubscribe)
+        self._started += 1
+        flight = _Flight(key if self.enabled else None, producer, self._remove)
+        if flight.key:
+            self._flights[flight.key] = flight
+        return Subscription(flight, True, self._unsubscribe)
+
+    def _unsubscribe(self, flight: _Flight) -> None:
+        flight.subscribers -= 1
+        if not flight.subscribers and not flight.done:
+            self._cancelled += 1
+            flight.task.cancel()
+            self._remove(flight)
+
+    def _remove(self, flight: _Flight) -> None:
+        if flight.key and self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def stats(self) -> CoalescerStats:
+        return CoalescerStats(in_flight=len(self._flights), started=self._started, joined=self._joined,
+                              cancelled=self._cancelled)
+
+
+response_coalescer = Coalescer(os.getenv("RESPONSE_COALESCING_ENABLED", "false").lower() == "true")
@@ -1,5 +1,6 @@
+import enum
 import uuid
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -23,3 +24,26 @@ class TranscriptionQuestion(BaseModel):
     id: uuid.UUID = Field(default_factory=uuid.uuid4)
     session: Session = Field(exclude=True)
     base64: str
+
+
+class AgentAction(enum.Enum):
+    MESSAGE = "message"
+    CLICK = "click"
+    FILL = "fill"
+    GOTO = "goto"
+    COT = "cot"
+    FINAL_ANSWER = "final_answer"
+
+
+class AgentStep(BaseModel):
+    action: AgentAction
+    selector: Optional[str] = None
+    value: Optional[str] = None
+
+
+class AgentFlow(BaseModel):
+    steps: List[AgentStep]
+
+    @staticmethod
+    def message(text: str) -> "AgentFlow":
+        return AgentFlow(steps=[AgentStep(action=AgentAction.MESSAGE, value=text)])
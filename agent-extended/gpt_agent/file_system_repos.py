@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import uuid
@@ -5,11 +6,64 @@ import base64
 import aiofiles
 import aiofiles.os
 import datetime
+import time
+from typing import AsyncIterator, Iterator, List, NamedTuple, Optional
+from langchain_core.chat_history import BaseChatMessageHistory
+from gpt_agent.cache import CacheStats, LruCache
+from gpt_agent.chat_history import JsonlChatMessageHistory
 from gpt_agent.domain import Session, Question, TranscriptionQuestion
+from gpt_agent.repos import Storage
+
+
+SESSIONS_PATH = "sessions"
 
 
 def get_session_path(session_id: uuid.UUID) -> str:
-    return os.path.join("sessions", str(session_id))
+    # sessions created before sharding are kept in the flat layout until they are migrated
+    ret = get_sharded_session_path(session_id)
+    if not os.path.exists(ret):
+        flat_path = get_flat_session_path(session_id)
+        if os.path.exists(flat_path):
+            return flat_path
+    return ret
+
+
+def get_sharded_session_path(session_id: uuid.UUID, sessions_path: str = SESSIONS_PATH) -> str:
+    # nesting sessions by the first characters of their id keeps directories small
+    session_id = str(session_id)
+    return os.path.join(sessions_path, session_id[0:2], session_id[2:4], session_id)
+
+
+def get_flat_session_path(session_id: uuid.UUID, sessions_path: str = SESSIONS_PATH) -> str:
+    return os.path.join(sessions_path, str(session_id))
+
+
+def list_session_paths(sessions_path: str = SESSIONS_PATH) -> Iterator[str]:
+    """Lists folders of sessions in both flat and sharded layouts, ignoring links left by migrations."""
+    with os.scandir(sessions_path) as entries:
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if _is_uuid(entry.name):
+                yield entry.path
+            elif len(entry.name) == 2:
+                yield from _list_shard_session_paths(entry.path)
+
+
+def _list_shard_session_paths(shard_path: str) -> Iterator[str]:
+    with os.scandir(shard_path) as shards:
+        for shard in shards:
+            if shard.is_dir(follow_symlinks=False) and len(shard.name) == 2:
+                with os.scandir(shard.path) as entries:
+                    yield from (e.path for e in entries if e.is_dir(follow_symlinks=False) and _is_uuid(e.name))
+
+
+def _is_uuid(name: str) -> bool:
+    try:
+        uuid.UUID(name)
+        return True
+    except ValueError:
+        return False
 
 
 async def _write_session_file(file_name: str, body: str, session: Session):
@@ -17,20 +71,67 @@ async def _write_session_file(file_name: str, body: str, session: Session):
     async with aiofiles.open(file_path, 'w') as outfile:
         await outfile.write(body)
 
-async def _write_audio_file(file_name: str, body: str, session: Session):
-    session_id_path = get_session_path(session.id)
-    session_id_audio_path = os.path.join(session_id_path, "audio") 
 
-    if os.path.exists(session_id_path):
-        os.makedirs(session_id_audio_path, exist_ok=True)
+class AudioTooLargeError(Exception):
+    pass
+
+
+def _build_audio_file_path(session: Session) -> str:
+    session_id_audio_path = os.path.join(get_session_path(session.id), "audio")
+    os.makedirs(session_id_audio_path, exist_ok=True)
+
+    formatted_date = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
+    return os.path.join(session_id_audio_path, f'{formatted_date}.webm')
 
-    audio_file_path = os.path.join(session_id_audio_path, file_name)
 
+async def _write_audio_file(body: str, session: Session):
+    audio_file_path = _build_audio_file_path(session)
     async with aiofiles.open(audio_file_path, 'wb') as outfile:
         await outfile.write(base64.b64decode(body))
     return audio_file_path
 
 
+async def _write_audio_stream(chunks: AsyncIterator[bytes], max_size: int, session: Session) -> str:
+    audio_file_path = _build_audio_file_path(session)
+    size = 0
+    try:
+        async with aiofiles.open(audio_file_path, 'wb') as outfile:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise AudioTooLargeError(f'audio exceeds {max_size} bytes')
+                await outfile.write(chunk)
+    except BaseException:
+        if await aiofiles.os.path.exists(audio_file_path):
+            await aiofiles.os.remove(audio_file_path)
+        raise
+    return audio_file_path
+
+
+class _CachedSession(NamedTuple):
+    session: Session
+    mtime_ns: int
+    validated_at: float
+
+
+# Sessions are cached in memory to avoid reading and parsing session.json on each request. Cached
+# sessions are revalidated against the file modification time at most once per revalidate period,
+# so changes made by other processes are eventually picked up.
+_sessions_cache: LruCache[uuid.UUID, _CachedSession] = LruCache(int(os.getenv("SESSION_CACHE_MAX_SIZE", "1024")))
+_session_revalidate_period = float(os.getenv("SESSION_CACHE_REVALIDATE_SECONDS", "5"))
+
+
+def _get_session_file_path(session_id: uuid.UUID) -> str:
+    return os.path.join(get_session_path(session_id), 'session.json')
+
+
+def session_cache_stats() -> CacheStats:
+    return _sessions_cache.stats()
+
+
+def invalidate_cached_session(session_id: uuid.UUID) -> None:
+    _sessions_cache.pop(session_id)
+
 
 class SessionsRepository:
 
@@ -39,15 +140,29 @@ class SessionsRepository:
         session_path = get_session_path(session.id)
         await aiofiles.os.makedirs(session_path, exist_ok=True)
         await _write_session_file('session.json', session.model_dump_json(), session)
+        stat = await aiofiles.os.stat(_get_session_file_path(session.id))
+        _sessions_cache.put(session.id, _CachedSession(session, stat.st_mtime_ns, time.monotonic()))
 
     @staticmethod
     async def find_session(session_id: str) -> Session | None:
-        session_path = get_session_path(uuid.UUID(session_id))
-        if not await aiofiles.os.path.exists(session_path):
+        session_uuid = uuid.UUID(session_id)
+        cached = _sessions_cache.get(session_uuid)
+        now = time.monotonic()
+        if cached and now - cached.validated_at < _session_revalidate_period:
+            return cached.session
+        file_path = _get_session_file_path(session_uuid)
+        try:
+            mtime_ns = (await aiofiles.os.stat(file_path)).st_mtime_ns
+        except FileNotFoundError:
+            _sessions_cache.pop(session_uuid)
             return None
-        async with aiofiles.open(os.path.join(session_path, 'session.json')) as f:
-            session_dict = json.loads(await f.read())
-            return Session(**session_dict)
+        if cached and cached.mtime_ns == mtime_ns:
+            _sessions_cache.put(session_uuid, cached._replace(validated_at=now))
+            return cached.session
+        async with aiofiles.open(file_path) as f:
+            ret = Session(**json.loads(await f.read()))
+        _sessions_cache.put(session_uuid, _CachedSession(ret, mtime_ns, now))
+        return ret
 
 
 class QuestionsRepository:
@@ -56,11 +171,34 @@ class QuestionsRepository:
     async def save_question(question: Question) -> None:
         await _write_session_file(f'question-{question.id}.json', question.model_dump_json(), question.session)
 
+
 class TranscriptionsRepository:
 
     @staticmethod
     async def save_audio(question: TranscriptionQuestion) -> str:
-        now = datetime.datetime.now()
-        formatted_date = now.strftime("%Y-%m-%d_%H-%M-%S")
-        file_path = await _write_audio_file(f'{formatted_date}.webm', question.base64, question.session)
-        return file_path
+        return await _write_audio_file(question.base64, question.session)
+
+    @staticmethod
+    async def save_audio_stream(chunks: AsyncIterator[bytes], max_size: int, session: Session) -> str:
+        return await _write_audio_stream(chunks, max_size, session)
+
+
+class FileSystemStorage(Storage):
+    """Stores each session in a folder with session.json, a file per question and chat_history.jsonl."""
+
+    async def save_session(self, session: Session) -> None:
+        await SessionsRepository.save_session(session)
+
+    async def find_session(self, session_id: str) -> Session | None:
+        return await SessionsRepository.find_session(session_id)
+
+    async def save_question(self, question: Question) -> None:
+        await QuestionsRepository.save_question(question)
+
+    async def save_questions(self, questions: List[Question]) -> List[Optional[BaseException]]:
+        results = await asyncio.gather(*(QuestionsRepository.save_question(q) for q in questions),
+                                       return_exceptions=True)
+        return [r if isinstance(r, BaseException) else None for r in results]
+
+    def build_chat_history(self, session: Session) -> BaseChatMessageHistory:
+        return JsonlChatMessageHistory(os.path.join(get_session_path(session.id), "chat_history.jsonl"))
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+import aiofiles
+import aiofiles.os
+from langchain.chains import LLMChain
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.summary import SummarizerMixin
+from langchain_core.messages import BaseMessage, get_buffer_string
+from langchain_core.pydantic_v1 import PrivateAttr
+
+from gpt_agent.admission import admission_controller, AdmissionRejectedError, Priority
+
+logger = logging.getLogger(__name__)
+
+# rough average for OpenAI tokenizers, which avoids depending on tiktoken to count tokens
+_CHARS_PER_TOKEN = 4
+# tokens added by the chat format to each message
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class RollingSummaryMemory(BaseChatMemory, SummarizerMixin):
+    """
+    Memory that only sends to the model the most recent messages fitting in `max_token_limit`,
+    preceded by a running summary of older messages.
+
+    Token counts are estimated from the length of messages, once per stored message. Messages falling out of the token budget
+    are folded into the summary by a background task, so answering a question never waits for the
+    summarization. Summary state is persisted in `summary_path` to survive agent restarts.
+    Summarization is scheduled as background work of `user`, so it doesn't delay questions.
+    """
+
+    max_token_limit: int = 2000
+    memory_key: str = "chat_history"
+    summary_path: Optional[str] = None
+    user: str = ""
+    summary: str = ""
+    summarized_count: int = 0
+    _token_counts: List[int] = PrivateAttr(default_factory=list)
+    _summary_task: Optional[asyncio.Task] = PrivateAttr(default=None)
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        if self.summary_path and os.path.exists(self.summary_path):
+            with open(self.summary_path) as f:
+                state = json.loads(f.read())
+            self.summary = state["summary"]
+            self.summarized_count = state["summarized_count"]
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        messages = self.chat_memory.messages
+        window_start = self._find_window_start(messages)
+        if window_start > self.summarized_count:
+            self._schedule_summary(messages[self.summarized_count:window_start], window_start)
+        ret = messages[window_start:]
+        if self.summary:
+            ret = [self.summary_message_cls(content=self.summary)] + ret
+        return {self.memory_key: ret}
+
+    def _find_window_start(self, messages: List[BaseMessage]) -> int:
+        if len(messages) < len(self._token_counts):
+            self._token_counts = []
+        for message in messages[len(self._token_counts):]:
+            self._token_counts.append(_estimate_tokens(message))
+        tokens = 0
+        ret = len(messages)
+        while ret > self.summarized_count and tokens + self._token_counts[ret - 1] <= self.max_token_limit:
+            ret -= 1
+            tokens += self._token_counts[ret]
+        return ret
+
+    def _schedule_summary(self, messages: List[BaseMessage], summarized_count: int) -> None:
+        if self._summary_task is not None and not self._summary_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._summary_task = loop.create_task(self._update_summary(messages, summarized_count))
+
+    async def _update_summary(self, messages: List[BaseMessage], summarized_count: int) -> None:
+        try:
+            new_lines = get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+            chain = LLMChain(llm=self.llm, prompt=self.prompt)
+            permit = await admission_controller.acquire(self.user, Priority.BACKGROUND)
+            try:
+                self.summary = await chain.apredict(summary=self.summary, new_lines=new_lines)
+            finally:
+                permit.release()
+            self.summarized_count = summarized_count
+            if self.summary_path:
+                await aiofiles.os.makedirs(os.path.dirname(self.summary_path), exist_ok=True)
+                async with aiofiles.open(self.summary_path, "w") as f:
+                    await f.write(json.dumps({"summary": self.summary, "summarized_count": summarized_count}))
+        except AdmissionRejectedError as e:
+            # summary is updated again when loading memory variables
+            logger.debug("Postponed conversation summary: %s", e)
+        except Exception as e:
+            logger.exception("Problem updating conversation summary", exc_info=e)
+
+    def clear(self) -> None:
+        super().clear()
+        self.summary = ""
+        self.summarized_count = 0
+        self._token_counts = []
+        if self.summary_path and os.path.exists(self.summary_path):
+            os.remove(self.summary_path)
+
+
+def _estimate_tokens(message: BaseMessage) -> int:
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    return -(-len(content) // _CHARS_PER_TOKEN) + _MESSAGE_OVERHEAD_TOKENS
@@ -0,0 +1,124 @@
+"""
+Migrates sessions stored with the filesystem storage.
+
+Run from agent-extended folder with:
+- python -m gpt_agent.migrate sqlite [--sessions-dir sessions] [--db sessions.db]: imports sessions into a SQLite database.
+- python -m gpt_agent.migrate shard [--sessions-dir sessions] [--prune-links]: moves sessions to the sharded layout.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import uuid
+from typing import Iterator, List
+
+import dotenv
+
+from gpt_agent.chat_history import JsonlChatMessageHistory
+from gpt_agent.domain import Session, Question
+from gpt_agent.file_system_repos import get_flat_session_path, get_sharded_session_path, list_session_paths
+from gpt_agent.sqlite_repos import SessionRecords, SqliteStorage
+
+logger = logging.getLogger("gpt_agent.migrate")
+
+
+def _read_session_records(sessions_dir: str) -> Iterator[SessionRecords]:
+    for session_path in list_session_paths(sessions_dir):
+        session_file_path = os.path.join(session_path, "session.json")
+        if not os.path.exists(session_file_path):
+            continue
+        try:
+            yield _read_session_dir(session_path, session_file_path)
+        except Exception as e:
+            logger.warning("Skipping session %s: %s", session_path, e)
+
+
+def _read_session_dir(session_path: str, session_file_path: str) -> SessionRecords:
+    with open(session_file_path) as f:
+        session = Session.model_validate_json(f.read())
+    questions = []
+    for question_path in glob.glob(os.path.join(session_path, "question-*.json")):
+        with open(question_path) as f:
+            question = Question(**json.loads(f.read()), session=session)
+        questions.append((question, os.path.getmtime(question_path)))
+    history = JsonlChatMessageHistory(os.path.join(session_path, "chat_history.jsonl"))
+    return SessionRecords(session, os.path.getmtime(session_file_path), questions, history.messages)
+
+
+async def migrate_to_sqlite(sessions_dir: str, db_path: str, batch_size: int) -> None:
+    storage = SqliteStorage(db_path, 1)
+    await storage.start()
+    try:
+        imported = 0
+        total = 0
+        batch: List[SessionRecords] = []
+        # sessions are read in a worker thread, since chat histories can't be read synchronously from the event loop
+        session_records = _read_session_records(sessions_dir)
+        while (records := await asyncio.to_thread(next, session_records, None)) is not None:
+            batch.append(records)
+            if len(batch) >= batch_size:
+                imported += await storage.import_sessions(batch)
+                total += len(batch)
+                batch = []
+                logger.info("Processed %d sessions", total)
+        imported += await storage.import_sessions(batch)
+        total += len(batch)
+        logger.info("Imported %d sessions, skipped %d already existing ones", imported, total - imported)
+    finally:
+        await storage.stop()
+
+
+def shard_sessions(sessions_dir: str, prune_links: bool) -> None:
+    """
+    Moves sessions in the flat layout to the sharded one while the agent is running.
+
+    Each session folder is atomically renamed, leaving a link in its previous location so agents
+    already holding the previous path keep working. Links can be removed with `prune_links` once
+    agents have been restarted or have evicted migrated sessions.
+    """
+    moved = 0
+    for session_path in list(list_session_paths(sessions_dir)):
+        session_id = uuid.UUID(os.path.basename(session_path))
+        flat_path = get_flat_session_path(session_id, sessions_dir)
+        if session_path != flat_path:
+            continue
+        sharded_path = get_sharded_session_path(session_id, sessions_dir)
+        os.makedirs(os.path.dirname(sharded_path), exist_ok=True)
+        os.rename(flat_path, sharded_path)
+        if not prune_links:
+            os.symlink(os.path.relpath(sharded_path, sessions_dir), flat_path, target_is_directory=True)
+        moved += 1
+    pruned = 0
+    if prune_links:
+        with os.scandir(sessions_dir) as entries:
+            for entry in entries:
+                if entry.is_symlink():
+                    os.remove(entry.path)
+                    pruned += 1
+    logger.info("Moved %d sessions to sharded layout, pruned %d links", moved, pruned)
+
+
+def main() -> None:
+    dotenv.load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(prog="python -m gpt_agent.migrate")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sqlite_parser = commands.add_parser("sqlite", help="import sessions folder into a SQLite database")
+    sqlite_parser.add_argument("--sessions-dir", default="sessions")
+    sqlite_parser.add_argument("--db", default=os.getenv("SQLITE_PATH", "sessions.db"))
+    sqlite_parser.add_argument("--batch-size", type=int, default=500)
+    shard_parser = commands.add_parser("shard", help="move sessions folders to the sharded layout")
+    shard_parser.add_argument("--sessions-dir", default="sessions")
+    shard_parser.add_argument("--prune-links", action="store_true",
+                              help="don't leave links in the previous location of sessions and remove existing ones")
+    args = parser.parse_args()
+    if args.command == "sqlite":
+        asyncio.run(migrate_to_sqlite(args.sessions_dir, args.db, args.batch_size))
+    elif args.command == "shard":
+        shard_sessions(args.sessions_dir, args.prune_links)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import json
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.tools import BaseTool
+from langchain_community.adapters.openai import convert_message_to_dict
+from langchain_community.tools.convert_to_openai import format_tool_to_openai_function
+from openai import AsyncOpenAI
+
+from gpt_agent.tool_dispatch import ToolCall, ToolDispatcher
+
+# same output as langchain AgentExecutor when it runs out of iterations
+ITERATIONS_LIMIT_OUTPUT = "Agent stopped due to iteration limit or time limit."
+
+TokenHandler = Callable[[str], None]
+
+
+class AgentRun(NamedTuple):
+    output: str
+    used_tools: Set[str]
+
+
+class NativeAgent:
+    """
+    Minimal async tool calling loop, equivalent to langchain OpenAIFunctionsAgent with
+    AgentExecutor but allowing several tool calls per step, which streams completions directly from the provider client.
+
+    Several tools requested by the model in the same step run concurrently with `dispatcher`, which
+    requires tool calls support in the provider (eg: Azure OpenAI API version 2023-12-01-preview or later).
+
+    It avoids the per token and per step overhead of langchain chains and callbacks, but it doesn't
+    support langchain callbacks (eg: LangSmith tracing).
+    """
+
+    def __init__(self, client: AsyncOpenAI, model: str, temperature: float, system_prompt: str,
+                 tools: List[BaseTool], memory: BaseChatMemory, max_iterations: int, dispatcher: ToolDispatcher):
+        self._client = client
+        self._model = model
+        self._temperature = temperature
+        self._system_prompt = system_prompt
+        self._tools = {t.name: t for t in tools}
+        self._tool_specs = [{"type": "function", "function": format_tool_to_openai_function(t)} for t in tools]
+        self._memory = memory
+        self._max_iterations = max_iterations
+        self._dispatcher = dispatcher
+
+    async def arun(self, question: str, on_token: TokenHandler) -> AgentRun:
+        inputs = {"input": question}
+        history = self._memory.load_memory_variables(inputs)[self._memory.memory_key]
+        messages = ([{"role": "system", "content": self._system_prompt}]
+                    + [convert_message_to_dict(m) for m in history]
+                    + [{"role": "user", "content": question}])
+        used_tools = set()
+        output = ITERATIONS_LIMIT_OUTPUT
+        for _ in range(self._max_iterations):
+            content, tool_calls = await self._complete(messages, on_token)
+            if not tool_calls:
+                output = content
+                break
+            used_tools.update(call["function"]["name"] for call in tool_calls)
+            observations, return_direct = await self._call_tools(tool_calls)
+            if return_direct:
+                output = observations[0]
+                break
+            messages.append({"role": "assistant", "content": content or None, "tool_calls": tool_calls})
+            messages.extend({"role": "tool", "tool_call_id": call["id"], "content": observation}
+                            for call, observation in zip(tool_calls, observations))
+        self._memory.save_context(inputs, {"output": output})
+        return AgentRun(output, used_tools)
+
+    async def _complete(self, messages: List[Dict[str, Any]], on_token: TokenHandler) \
+            -> Tuple[str, List[Dict[str, Any]]]:
+        stream = await self._client.chat.completions.create(
+            model=self._model, temperature=self._temperature, messages=messages,
+            tools=self._tool_specs, stream=True)
+        content = ""
+        tool_calls: Dict[int, Dict[str, Any]] = {}
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content += delta.content
+                    on_token(delta.content)
+                for call_delta in delta.tool_calls or []:
+                    call = tool_calls.setdefault(
+                        call_delta.index, {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+                    call["id"] += call_delta.id or ""
+                    if call_delta.function:
+                        call["function"]["name"] += call_delta.function.name or ""
+                        call["function"]["arguments"] += call_delta.function.arguments or ""
+        finally:
+            # releases the connection when the run is cancelled before the response ends
+            await stream.close()
+        return content, [tool_calls[index] for index in sorted(tool_calls)]
+
+    async def _call_tools(self, tool_calls: List[Dict[str, Any]]) -> Tuple[List[str], bool]:
+        """Returns the observation of each call, and if the only called tool returns directly to the user."""
+        observations: List[Optional[str]] = []
+        calls = []
+        for call in tool_calls:
+            name = call["function"]["name"]
+            tool = self._tools.get(name)
+            if tool is None:
+                observations.append(f"{name} is not a valid tool, try one of [{', '.join(self._tools)}].")
+                continue
+            tool_input = json.loads(call["function"]["arguments"] or "{}")
+            # tools without args schema receive a single argument
+            if "__arg1" in tool_input:
+                tool_input = tool_input["__arg1"]
+            observations.append(None)
+            calls.append(ToolCall(tool, tool_input))
+        results = iter(await self._dispatcher.dispatch(calls))
+        observations = [observation if observation is not None else next(results) for observation in observations]
+        # like AgentExecutor, return direct is only honored when a single tool is called
+        return_direct = len(calls) == 1 == len(tool_calls) and calls[0].tool.return_direct
+        return observations, return_direct
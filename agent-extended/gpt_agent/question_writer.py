@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from gpt_agent.domain import Question
+from gpt_agent.repos import Storage
+from gpt_agent.storage import storage
+
+logger = logging.getLogger(__name__)
+
+_RETRY_DELAY_SECONDS = 0.5
+
+
+class QuestionWriterStats(BaseModel):
+    queued: int
+    max_queued: int
+    written: int
+    retried: int
+    failed: int
+
+
+class QuestionWriter:
+    """
+    Persists questions in background, so answers don't wait for the storage.
+
+    Questions are written in batches of up to `batch_size`, waiting at most `flush_period` seconds
+    for a batch to fill. When `max_queue_size` questions are pending, adding new ones waits for
+    the queue to have room, slowing down answers instead of growing memory without limit.
+    Questions of a batch that couldn't be saved are retried, up to `max_attempts` in total.
+    """
+
+    def __init__(self, target: Storage, max_queue_size: int, batch_size: int, flush_period: float,
+                 max_attempts: int):
+        self._storage = target
+        self._queue: asyncio.Queue[Question] = asyncio.Queue(max_queue_size)
+        self._batch_size = batch_size
+        self._flush_period = flush_period
+        self._max_attempts = max(1, max_attempts)
+        self._task: Optional[asyncio.Task] = None
+        self._written = 0
+        self._retried = 0
+        self._failed = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Waits for queued questions to be written and stops the writer."""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def put(self, question: Question) -> None:
+        await self._queue.put(question)
+
+    def stats(self) -> QuestionWriterStats:
+        return QuestionWriterStats(queued=self._queue.qsize(), max_queued=self._queue.maxsize,
+                                   written=self._written, retried=self._retried, failed=self._failed)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._flush_period
+            while len(batch) < self._batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._write(batch)
+
+    async def _write(self, batch: List[Question]) -> None:
+        try:
+            pending = batch
+            for attempt in range(1, self._max_attempts + 1):
+                if attempt > 1:
+                    await asyncio.sleep(_RETRY_DELAY_SECONDS * (attempt - 1))
+                    self._retried += len(pending)
+                errors = await self._save(pending)
+                failed = [(q, e) for q, e in zip(pending, errors) if e is not None]
+                self._written += len(pending) - len(failed)
+                pending = [q for q, _ in failed]
+                if not pending:
+                    return
+            self._failed += len(failed)
+            for question, error in failed:
+                logger.error("Problem saving question %s of session %s", question.id, question.session.id,
+                             exc_info=error)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _save(self, questions: List[Question]) -> List[Optional[BaseException]]:
+        try:
+            return await self._storage.save_questions(questions)
+        except Exception as e:
+            return [e] * len(questions)
+
+
+question_writer = QuestionWriter(storage, int(os.getenv("QUESTION_QUEUE_MAX_SIZE", "1000")),
+                                 int(os.getenv("QUESTION_BATCH_SIZE", "50")),
+                                 float(os.getenv("QUESTION_FLUSH_PERIOD_SECONDS", "1")),
+                                 int(os.getenv("QUESTION_WRITE_MAX_ATTEMPTS", "3")))
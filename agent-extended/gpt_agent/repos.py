@@ -0,0 +1,51 @@
+import abc
+from typing import List, Optional
+
+from langchain_core.chat_history import BaseChatMessageHistory
+
+from gpt_agent.domain import Session, Question
+
+
+class Storage(abc.ABC):
+    """
+    Persistence of sessions, questions and chat history.
+
+    Audios and conversation summaries are always stored in the session folder, independently of
+    the storage, since they are not indexed or queried.
+    """
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def save_session(self, session: Session) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def find_session(self, session_id: str) -> Session | None:
+        pass
+
+    @abc.abstractmethod
+    async def save_question(self, question: Question) -> None:
+        pass
+
+    async def save_questions(self, questions: List[Question]) -> List[Optional[BaseException]]:
+        """
+        Saves the questions and returns the error of each one that couldn't be saved, or None for
+        saved ones. Errors raised instead apply to all the questions.
+        """
+        ret = []
+        for question in questions:
+            try:
+                await self.save_question(question)
+                ret.append(None)
+            except Exception as e:
+                ret.append(e)
+        return ret
+
+    @abc.abstractmethod
+    def build_chat_history(self, session: Session) -> BaseChatMessageHistory:
+        pass
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+from typing import List, NamedTuple, Optional
+
+from langchain.tools import BaseTool
+from langchain_core.messages import BaseMessage, messages_to_dict
+
+from gpt_agent.cache import CacheStats, LruCache
+from gpt_agent.domain import AgentFlow
+
+_CACHEABLE_METADATA_KEY = "response_cacheable"
+
+
+def no_response_cache(tool: BaseTool) -> BaseTool:
+    """Marks a tool as non-deterministic, so responses using it are not cached."""
+    tool.metadata = {**(tool.metadata or {}), _CACHEABLE_METADATA_KEY: False}
+    return tool
+
+
+def is_response_cacheable(tool: BaseTool) -> bool:
+    return (tool.metadata or {}).get(_CACHEABLE_METADATA_KEY, True)
+
+
+class CachedResponse(NamedTuple):
+    # items generated by the agent, which are replayed as they were streamed
+    items: List[AgentFlow | str]
+    # agent output, which is stored in the conversation memory
+    output: str
+
+
+class ResponseCache:
+    """
+    Caches agent responses for questions asked with the exact same prompt, history and model
+    configuration. Entries expire after `ttl` seconds, and a ttl of 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self._ttl = ttl
+        self._responses: LruCache[str, CachedResponse] = LruCache(max_size, ttl=ttl)
+
+    @property
+    def enabled(self) -> bool:
+        return self._ttl > 0
+
+    @staticmethod
+    def build_key(system_prompt: str, history: List[BaseMessage], question: str, model: str,
+                  temperature: float) -> str:
+        content = json.dumps([system_prompt, messages_to_dict(history), question, model, temperature])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        return self._responses.get(key)
+
+    def put(self, key: str, response: CachedResponse) -> None:
+        self._responses.put(key, response)
+
+    def stats(self) -> CacheStats:
+        return self._responses.stats()
+
+
+response_cache = ResponseCache(int(os.getenv("RESPONSE_CACHE_MAX_SIZE", "1024")),
+                               float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "0")))
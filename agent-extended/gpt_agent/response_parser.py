@@ -0,0 +1,254 @@
+import enum
+import re
+from typing import Dict, Generic, List, Type, TypeVar
+
+# This module is shared by agent-extended and agent-simple, so keep both copies in sync and don't
+# import anything from the agents. Steps are built with the step class provided by each agent.
+
+COT = "cot"
+FINAL_ANSWER = "final_answer"
+
+_RE_MARKER = re.compile(r"\b(?:(?P<reasoning>RAZONAMIENTO)|RESPUESTA\s+FINAL)\s*:", re.I)
+_RE_FINAL = re.compile(r"\bRESPUESTA\s+FINAL\s*:[ \t]*", re.I)
+_RE_REASONING = re.compile(r"\bRAZONAMIENTO\s*:\s*", re.I)
+_BULLET_RE = re.compile(r"\s*(?:\d+[\.\-\)]|[•\-])\s*")
+_RE_SENTENCE_END = re.compile(r"\.\s+")
+_DATA_PREFIX = "data:"
+_WHITESPACE = " \t\r\n"
+# text searched again with new text, so markers split between tokens are found without searching everything
+_MAX_MARKER_LENGTH = 32
+# responses without a marker starting in this length are plain text, so they are not held until they end
+_MAX_PREAMBLE_LENGTH = 1000
+
+S = TypeVar("S")
+
+
+class _Section(enum.Enum):
+    PREAMBLE = "preamble"
+    COT = "cot"
+    FINAL = "final"
+    PLAIN = "plain"
+
+
+class StreamingResponseParser(Generic[S]):
+    """
+    Parses agent responses in a single pass, generating steps as soon as they are complete.
+
+    Each chain of thought step (lines after `RAZONAMIENTO:`, split by bullets) is generated once
+    the next step starts, and the text after `RESPUESTA FINAL:` is generated in chunks ending in
+    whitespace, never made only of whitespace (the extension strips leading whitespace of each
+    final answer chunk). Text before the first marker is held until a marker arrives, and is
+    considered reasoning. Responses without markers in their first `_MAX_PREAMBLE_LENGTH`
+    characters are generated as plain text, and in responses with reasoning but no final answer
+    the last reasoning step is the answer. Parsing a complete response gives the same result as
+    parsing it in chunks, and each part of the response is searched for markers once.
+    """
+
+    def __init__(self, step_class: Type[S]):
+        self._step_class = step_class
+        self._section = _Section.PREAMBLE
+        self._buffer = ""
+        # position of the buffer up to which markers were searched
+        self._scan_start = 0
+        # start of the reasoning line being received, when it is long
+        self._line_parts: List[str] = []
+        self._line_head = ""
+        self._at_line_start = True
+        # spaces after a removed prefix are removed as well, even if they arrive later
+        self._after_prefix = False
+        self._cot_parts: List[str] = []
+        self._cot_lines = 0
+        self._cot_steps = 0
+        self._final_started = False
+        self.emitted = False
+
+    def feed(self, token: str) -> List[S | str]:
+        text = self._clean(token)
+        self._buffer += text
+        if self._is_incomplete(text):
+            return []
+        ret = self._parse(final=False)
+        self.emitted = self.emitted or bool(ret)
+        return ret
+
+    def finish(self, token: str = "") -> List[S | str]:
+        text = self._clean(token) + self._line_head
+        self._buffer += text
+        self._line_head = ""
+        ret = self._parse(final=True)
+        self.emitted = self.emitted or bool(ret)
+        return ret
+
+    def _is_incomplete(self, text: str) -> bool:
+        # avoids parsing the buffer again when the new text can't complete a line, marker or word
+        if self._section == _Section.COT:
+            return "\n" not in text and ":" not in text
+        if self._section == _Section.FINAL:
+            return not text or text.isalnum()
+        if self._section == _Section.PREAMBLE:
+            return ":" not in text and len(self._buffer) < _MAX_PREAMBLE_LENGTH + _MAX_MARKER_LENGTH
+        return False
+
+    def _clean(self, token: str) -> str:
+        # removes 'data:' prefixes from lines
+        if self._after_prefix:
+            token = token.lstrip(" \t")
+            self._after_prefix = not token
+        if not self._at_line_start and "\n" not in token:
+            return token
+        text = self._line_head + token
+        self._line_head = ""
+        # the rest of a line without its prefix is not at the start of the line anymore
+        last_line_prefixed = False
+        if _DATA_PREFIX in text:
+            lines = text.split("\n")
+            for i in range(0 if self._at_line_start else 1, len(lines)):
+                if lines[i].startswith(_DATA_PREFIX):
+                    lines[i] = lines[i][len(_DATA_PREFIX):].lstrip(" \t")
+                    last_line_prefixed = i == len(lines) - 1
+            text = "\n".join(lines)
+            self._after_prefix = last_line_prefixed and not lines[-1]
+        last_line_start = text.rfind("\n") + 1
+        if (last_line_start or self._at_line_start) and not last_line_prefixed:
+            last_line = text[last_line_start:]
+            if last_line and len(last_line) < len(_DATA_PREFIX) and _DATA_PREFIX.startswith(last_line):
+                # wait for more text to know if the line starts with the prefix
+                self._line_head = last_line
+                text = text[:last_line_start]
+        if self._line_head:
+            self._at_line_start = True
+        elif last_line_prefixed:
+            self._at_line_start = False
+        elif text:
+            self._at_line_start = text[-1] == "\n"
+        return text
+
+    def _parse(self, final: bool) -> List[S | str]:
+        ret = []
+        while True:
+            section = self._section
+            if section == _Section.PREAMBLE:
+                self._parse_preamble(final, ret)
+            elif section == _Section.COT:
+                self._parse_cot(final, ret)
+            elif section == _Section.FINAL:
+                self._parse_final(final, ret)
+            elif self._buffer:
+                ret.append(self._buffer)
+                self._buffer = ""
+            if section == self._section:
+                return ret
+
+    def _search(self, pattern: re.Pattern) -> re.Match | None:
+        ret = pattern.search(self._buffer, max(0, self._scan_start - _MAX_MARKER_LENGTH))
+        self._scan_start = 0 if ret else len(self._buffer)
+        return ret
+
+    def _parse_preamble(self, final: bool, ret: List[S | str]) -> None:
+        marker = self._search(_RE_MARKER)
+        if marker and marker.start() >= _MAX_PREAMBLE_LENGTH:
+            marker = None
+        if marker and marker.group("reasoning"):
+            # text before the reasoning is part of it
+            self._buffer = self._buffer[:marker.start()] + self._buffer[marker.end():]
+            self._section = _Section.COT
+        elif marker:
+            # text before the final answer is considered reasoning
+            self._section = _Section.COT
+        elif final or len(self._buffer) >= _MAX_PREAMBLE_LENGTH + _MAX_MARKER_LENGTH:
+            self._section = _Section.PLAIN
+
+    def _parse_cot(self, final: bool, ret: List[S | str]) -> None:
+        searched = self._scan_start
+        final_answer = self._search(_RE_FINAL)
+        if final_answer:
+            cot_text = self._take_line_start() + self._buffer[:final_answer.start()]
+            self._buffer = self._buffer[final_answer.end():]
+            self._section = _Section.FINAL
+        elif final:
+            cot_text, self._buffer = self._take_line_start() + self._buffer, ""
+        else:
+            # last line is kept since it might be the start of the final answer marker. It has no line
+            # breaks, so only new text is searched for them
+            line_end = self._buffer.rfind("\n", searched) + 1
+            cot_text = self._take_line_start() + self._buffer[:line_end] if line_end else ""
+            self._buffer = self._buffer[line_end:]
+            if len(self._buffer) > 2 * _MAX_MARKER_LENGTH:
+                # only the end of long lines is kept in the buffer, so adding text doesn't copy them. The
+                # character before the end is kept to find where words start
+                self._line_parts.append(self._buffer[:-_MAX_MARKER_LENGTH - 1])
+                self._buffer = self._buffer[-_MAX_MARKER_LENGTH - 1:]
+            self._scan_start = len(self._buffer)
+        for line in cot_text.splitlines():
+            self._parse_cot_line(line, ret)
+        if self._section != _Section.COT:
+            self._flush_cot(ret)
+        elif final:
+            # without final answer, the reasoning step not generated yet is the answer
+            answer = " ".join(self._cot_parts).strip()
+            self._cot_parts = []
+            if answer:
+                ret.append(answer)
+
+    def _take_line_start(self) -> str:
+        ret = "".join(self._line_parts)
+        self._line_parts = []
+        return ret
+
+    def _parse_cot_line(self, line: str, ret: List[S | str]) -> None:
+        if ":" in line:
+            line = _RE_REASONING.sub("", line)
+        if not line or line.isspace():
+            return
+        self._cot_lines += 1
+        bullet = _BULLET_RE.match(line)
+        if bullet:
+            self._emit_cot(ret)
+            line = line[bullet.end():]
+        self._cot_parts.append(line.strip())
+
+    def _emit_cot(self, ret: List[S | str]) -> None:
+        step = " ".join(self._cot_parts).strip()
+        self._cot_parts = []
+        if step:
+            ret.append(self._step_class(action=COT, value=step))
+            self._cot_steps += 1
+
+    def _flush_cot(self, ret: List[S | str]) -> None:
+        if self._cot_lines == 1 and not self._cot_steps and self._cot_parts:
+            # a single line of reasoning is split in sentences
+            sentences = [s.strip() for s in _RE_SENTENCE_END.split(self._cot_parts[0]) if s.strip()]
+            self._cot_parts = []
+            for sentence in sentences:
+                ret.append(self._step_class(action=COT, value=sentence if sentence.endswith(".") else sentence + "."))
+                self._cot_steps += 1
+        else:
+            self._emit_cot(ret)
+
+    def _parse_final(self, final: bool, ret: List[S | str]) -> None:
+        if final:
+            chunk, self._buffer = self._buffer.rstrip(), ""
+        else:
+            # trailing whitespace is kept until text follows it, so chunks are never only whitespace
+            text = self._buffer.rstrip(_WHITESPACE)
+            chunk_end = max(text.rfind(c) for c in _WHITESPACE) + 1
+            chunk, self._buffer = self._buffer[:chunk_end], self._buffer[chunk_end:]
+        if not self._final_started:
+            chunk = chunk.lstrip()
+        if chunk:
+            ret.append(self._step_class(action=FINAL_ANSWER, value=chunk))
+            self._final_started = True
+
+
+def parse_response(text: str, step_class: Type[S]) -> List[S | str]:
+    """Parses a complete response into steps, or plain text when it doesn't follow the format."""
+    return StreamingResponseParser(step_class).finish(text)
+
+
+def replace_placeholders(text: str, replacements: Dict[str, str]) -> str:
+    """Replaces all occurrences of the given placeholders in one pass over the text."""
+    placeholders = [p for p in replacements if p]
+    if not placeholders:
+        return text
+    pattern = re.compile("|".join(re.escape(p) for p in sorted(placeholders, key=len, reverse=True)))
+    return pattern.sub(lambda m: replacements[m.group(0)], text)
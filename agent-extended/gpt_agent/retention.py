@@ -0,0 +1,205 @@
+"""
+Expires idle sessions and old audios from the sessions folder.
+
+Besides running periodically in the agent, it can be run once (eg: from a cron job) from
+agent-extended folder with: python -m gpt_agent.retention
+"""
+import asyncio
+import logging
+import os
+import shutil
+import tarfile
+import time
+import uuid
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import dotenv
+from pydantic import BaseModel
+
+from gpt_agent.agent_pool import agent_pool
+from gpt_agent.file_system_repos import SESSIONS_PATH, invalidate_cached_session, list_session_paths, \
+    get_flat_session_path
+from gpt_agent.session_locks import LOCK_FILE_NAME, session_locks
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionReport(BaseModel):
+    archived_sessions: int = 0
+    deleted_audios: int = 0
+    archived_audios: int = 0
+    reclaimed_bytes: int = 0
+    archived_bytes: int = 0
+    duration_seconds: float = 0
+
+    def add(self, other: "RetentionReport") -> None:
+        for field in self.model_fields:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+
+class RetentionStats(BaseModel):
+    runs: int
+    last_run: Optional[RetentionReport]
+    total: RetentionReport
+
+
+class _SessionFile(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+
+
+class RetentionJob:
+    """
+    Archives sessions without activity for `session_ttl` seconds into a compressed file per session
+    in `archive_path`, removing them from the sessions folder. Audios older than `audio_ttl` seconds
+    in remaining sessions are deleted, or moved to `archive_path` when `archive_audios` is set.
+
+    Sessions are processed one at a time in a worker thread, pausing after each one as required to
+    not process more than `max_bytes_per_second`, so the job doesn't compete with answers I/O.
+    A ttl of 0 disables the associated expiration.
+
+    Sessions answering questions or with agents in the pool are not archived, and the rest are
+    archived holding the session lock, so questions arriving meanwhile wait for it.
+    """
+
+    def __init__(self, archive_path: str, session_ttl: float, audio_ttl: float, archive_audios: bool,
+                 max_bytes_per_second: int):
+        self._archive_path = archive_path
+        self._session_ttl = session_ttl
+        self._audio_ttl = audio_ttl
+        self._archive_audios = archive_audios
+        self._max_bytes_per_second = max_bytes_per_second
+        self._runs = 0
+        self._last_run: Optional[RetentionReport] = None
+        self._total = RetentionReport()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._session_ttl or self._audio_ttl)
+
+    async def run(self) -> RetentionReport:
+        start = time.monotonic()
+        ret = RetentionReport()
+        if os.path.exists(SESSIONS_PATH):
+            for session_path in await asyncio.to_thread(lambda: list(list_session_paths())):
+                try:
+                    report, processed_bytes = await self._process_session(session_path)
+                except Exception as e:
+                    logger.exception("Problem applying retention to %s", session_path, exc_info=e)
+                    continue
+                ret.add(report)
+                if processed_bytes and self._max_bytes_per_second:
+                    await asyncio.sleep(processed_bytes / self._max_bytes_per_second)
+        ret.duration_seconds = time.monotonic() - start
+        self._runs += 1
+        self._last_run = ret
+        self._total.add(ret)
+        logger.info("Retention reclaimed %d bytes archiving %d sessions, deleting %d audios and archiving %d audios",
+                    ret.reclaimed_bytes, ret.archived_sessions, ret.deleted_audios, ret.archived_audios)
+        return ret
+
+    def stats(self) -> RetentionStats:
+        return RetentionStats(runs=self._runs, last_run=self._last_run, total=self._total)
+
+    async def _process_session(self, session_path: str) -> Tuple[RetentionReport, int]:
+        files = await asyncio.to_thread(_list_files, session_path)
+        if not self._is_session_expired(session_path, files):
+            return await asyncio.to_thread(self._expire_audios, session_path, files)
+        session_id = uuid.UUID(os.path.basename(session_path))
+        if session_locks.is_locked(session_id) or session_id in agent_pool:
+            return RetentionReport(), 0
+        async with session_locks.lock(session_id):
+            # other processes may have answered questions of the session while waiting for its lock
+            files = await asyncio.to_thread(_list_files, session_path)
+            if not self._is_session_expired(session_path, files):
+                return RetentionReport(), 0
+            ret = await asyncio.to_thread(self._archive_session, session_path, files)
+            agent_pool.invalidate(session_id)
+            invalidate_cached_session(session_id)
+        return ret, sum(f.size for f in files)
+
+    def _is_session_expired(self, session_path: str, files: List[_SessionFile]) -> bool:
+        # the lock file is created when locking the session, even by this job, so it is not activity
+        last_activity = max((f.mtime for f in files if os.path.basename(f.path) != LOCK_FILE_NAME),
+                            default=os.path.getmtime(session_path))
+        return bool(self._session_ttl) and time.time() - last_activity > self._session_ttl
+
+    def _expire_audios(self, session_path: str, files: List[_SessionFile]) -> Tuple[RetentionReport, int]:
+        ret = RetentionReport()
+        if not self._audio_ttl:
+            return ret, 0
+        now = time.time()
+        audio_path = os.path.join(session_path, "audio")
+        processed_bytes = 0
+        for f in files:
+            if os.path.dirname(f.path) != audio_path or now - f.mtime <= self._audio_ttl:
+                continue
+            if self._archive_audios:
+                target_path = os.path.join(self._archive_path, os.path.relpath(f.path, SESSIONS_PATH))
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                shutil.move(f.path, target_path)
+                ret.archived_audios += 1
+                ret.archived_bytes += f.size
+            else:
+                os.remove(f.path)
+                ret.deleted_audios += 1
+            ret.reclaimed_bytes += f.size
+            processed_bytes += f.size
+        return ret, processed_bytes
+
+    def _archive_session(self, session_path: str, files: List[_SessionFile]) -> RetentionReport:
+        session_id = os.path.basename(session_path)
+        os.makedirs(self._archive_path, exist_ok=True)
+        archive_file_path = os.path.join(self._archive_path, session_id + ".tar.gz")
+        tmp_path = archive_file_path + ".tmp"
+        with tarfile.open(tmp_path, "w:gz") as archive:
+            archive.add(session_path, arcname=session_id)
+        os.replace(tmp_path, archive_file_path)
+        shutil.rmtree(session_path)
+        flat_path = get_flat_session_path(uuid.UUID(session_id))
+        if os.path.islink(flat_path):
+            os.remove(flat_path)
+        archived_bytes = os.path.getsize(archive_file_path)
+        return RetentionReport(archived_sessions=1, reclaimed_bytes=sum(f.size for f in files) - archived_bytes,
+                               archived_bytes=archived_bytes)
+
+
+def _list_files(path: str) -> List[_SessionFile]:
+    return list(_walk_files(path))
+
+
+def _walk_files(path: str) -> Iterator[_SessionFile]:
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk_files(entry.path)
+            else:
+                stat = entry.stat(follow_symlinks=False)
+                yield _SessionFile(entry.path, stat.st_size, stat.st_mtime)
+
+
+def _build_session_ttl() -> float:
+    ret = float(os.getenv("SESSION_RETENTION_TTL_SECONDS", "0"))
+    if ret and os.getenv("STORAGE_BACKEND", "filesystem") == "sqlite":
+        # activity of sessions stored in sqlite doesn't change their folders, so it is not known when they expire
+        logger.warning("SESSION_RETENTION_TTL_SECONDS is ignored with sqlite storage")
+        return 0
+    return ret
+
+
+def _build_retention_job() -> RetentionJob:
+    return RetentionJob(
+        os.getenv("RETENTION_ARCHIVE_PATH", "archive"),
+        _build_session_ttl(),
+        float(os.getenv("AUDIO_RETENTION_TTL_SECONDS", "0")),
+        os.getenv("AUDIO_RETENTION_ACTION", "delete") == "archive",
+        int(os.getenv("RETENTION_MAX_BYTES_PER_SECOND", str(10 * 1024 * 1024))))
+
+
+retention_job = _build_retention_job()
+
+if __name__ == "__main__":
+    dotenv.load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_build_retention_job().run())
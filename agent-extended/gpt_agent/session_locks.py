@@ -0,0 +1,131 @@
+import asyncio
+import contextlib
+import fcntl
+import os
+import uuid
+from typing import AsyncIterator, Dict, IO, List
+
+from pydantic import BaseModel
+
+from gpt_agent.file_system_repos import get_session_path
+
+LOCK_FILE_NAME = "session.lock"
+
+
+class SessionLocksStats(BaseModel):
+    locked_sessions: int
+    queued: int
+    # number of questions (including the running one) of the sessions with more questions waiting. Session
+    # ids are not included since metrics are public, and they give access to sessions without authentication
+    deepest_queues: List[int]
+
+
+class _SessionLock:
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class SessionLocks:
+    """
+    Serializes questions of each session, in the order they arrive, while questions of different
+    sessions run in parallel.
+
+    When `cross_process` is set, a file lock in the session folder is also held, so processes
+    sharing the sessions folder don't answer questions of the same session at the same time.
+    """
+
+    def __init__(self, cross_process: bool):
+        self.cross_process = cross_process
+        self._locks: Dict[uuid.UUID, _SessionLock] = {}
+
+    @contextlib.asynccontextmanager
+    async def lock(self, session_id: uuid.UUID) -> AsyncIterator[None]:
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = _SessionLock()
+        entry.depth += 1
+        try:
+            async with entry.lock:
+                if not self.cross_process:
+                    yield
+                    return
+                lock_file = await _lock_file(os.path.join(get_session_path(session_id), LOCK_FILE_NAME))
+                try:
+                    yield
+                finally:
+                    # closing the file releases the lock
+                    lock_file.close()
+        finally:
+            entry.depth -= 1
+            if not entry.depth:
+                del self._locks[session_id]
+
+    def queued_questions(self, session_id: uuid.UUID) -> int:
+        """Number of questions of the session being answered, or waiting to be answered, by this process."""
+        entry = self._locks.get(session_id)
+        return entry.depth if entry else 0
+
+    def is_locked(self, session_id: uuid.UUID) -> bool:
+        """Tells if questions of the session are being answered, or waiting to be answered, by this process."""
+        return session_id in self._locks
+
+    def stats(self, max_sessions: int = 20) -> SessionLocksStats:
+        deepest = sorted((entry.depth for entry in self._locks.values()), reverse=True)[:max_sessions]
+        return SessionLocksStats(
+            locked_sessions=len(self._locks),
+            queued=sum(entry.depth - 1 for entry in self._locks.values()),
+            deepest_queues=[depth for depth in deepest if depth > 1])
+
+
+# seconds between attempts to lock a file held by another process, doubled on each attempt up to the max
+_MIN_LOCK_POLL_SECONDS = 0.01
+_MAX_LOCK_POLL_SECONDS = 0.5
+
+
+def _open_lock_file(path: str) -> IO:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, "a")
+
+
+async def _lock_file(path: str) -> IO:
+    task = asyncio.ensure_future(asyncio.to_thread(_open_lock_file, path))
+    try:
+        ret = await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # the thread can't be interrupted, so the file is closed as soon as it is opened
+        task.add_done_callback(_close_opened)
+        raise
+    try:
+        # the lock is polled instead of waiting for it in a thread, so waiting questions don't take
+        # threads from the default executor
+        delay = _MIN_LOCK_POLL_SECONDS
+        while not _try_lock(ret):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _MAX_LOCK_POLL_SECONDS)
+    except BaseException:
+        ret.close()
+        raise
+    return ret
+
+
+def _try_lock(file: IO) -> bool:
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _close_opened(task: asyncio.Future) -> None:
+    if not task.cancelled() and task.exception() is None:
+        task.result().close()
+
+
+def _file_locks_default() -> str:
+    # sessions stored in sqlite have no folder, which locking them would create
+    return str(os.getenv("STORAGE_BACKEND", "filesystem") == "filesystem")
+
+
+session_locks = SessionLocks(os.getenv("SESSION_FILE_LOCKS", _file_locks_default()).lower() == "true")
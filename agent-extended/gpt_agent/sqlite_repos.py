@@ -0,0 +1,262 @@
+import asyncio
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple, TypeVar
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from gpt_agent.domain import Session, Question
+from gpt_agent.repos import Storage
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_user ON sessions (user, created_at);
+CREATE INDEX IF NOT EXISTS sessions_created_at ON sessions (created_at);
+CREATE TABLE IF NOT EXISTS questions (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS questions_session ON questions (session_id, created_at);
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chat_messages_session ON chat_messages (session_id, id);
+"""
+_INSERT_SESSION = "INSERT INTO sessions (id, user, data, created_at) VALUES (?, ?, ?, ?)"
+_UPSERT_SESSION = _INSERT_SESSION + " ON CONFLICT (id) DO UPDATE SET user = excluded.user, data = excluded.data"
+_IMPORT_SESSION = "INSERT OR IGNORE INTO sessions (id, user, data, created_at) VALUES (?, ?, ?, ?)"
+_INSERT_QUESTION = "INSERT OR IGNORE INTO questions (id, session_id, question, answer, created_at) VALUES (?, ?, ?, ?, ?)"
+_INSERT_MESSAGE = "INSERT INTO chat_messages (session_id, message, created_at) VALUES (?, ?, ?)"
+
+
+class SqliteDatabase:
+    """
+    Pool of connections to a SQLite database in WAL mode, so readers don't block the writer.
+
+    Statements run in a worker thread when used from async code, with no more than `pool_size`
+    connections in use at the same time. Each call runs in its own transaction.
+    """
+
+    def __init__(self, path: str, pool_size: int):
+        self._path = path
+        self._connections: queue.SimpleQueue[sqlite3.Connection] = queue.SimpleQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._async_slots = asyncio.Semaphore(pool_size)
+        self._all_connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        ret = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+        ret.execute("PRAGMA journal_mode=WAL")
+        # with WAL, NORMAL only risks losing the last transactions on a power loss, not corruption
+        ret.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self._all_connections.append(ret)
+        return ret
+
+    def run_sync(self, func: Callable[[sqlite3.Connection], T]) -> T:
+        with self._slots:
+            try:
+                conn = self._connections.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                with conn:
+                    return func(conn)
+            finally:
+                self._connections.put(conn)
+
+    async def run(self, func: Callable[[sqlite3.Connection], T]) -> T:
+        async with self._async_slots:
+            return await asyncio.to_thread(self.run_sync, func)
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._all_connections = self._all_connections, []
+        for conn in connections:
+            conn.close()
+        self._connections = queue.SimpleQueue()
+
+
+class SqliteChatMessageHistory(BaseChatMessageHistory):
+    """
+    Chat message history stored in the chat_messages table.
+
+    Messages are kept in memory once loaded, which has to be done with `aload` when there is a
+    running event loop. Added messages are inserted in batches by a background task when there is a
+    running event loop, so answering a question doesn't wait for the database.
+    """
+
+    def __init__(self, db: SqliteDatabase, session_id: uuid.UUID):
+        self._db = db
+        self._session_id = str(session_id)
+        self._messages: Optional[List[BaseMessage]] = None
+        # None entries represent history clears
+        self._pending: List[Optional[str]] = []
+        self._writer: Optional[asyncio.Task] = None
+
+    def refresh(self) -> None:
+        """Discards loaded messages, to get changes made by other processes."""
+        if not self._pending and (self._writer is None or self._writer.done()):
+            self._messages = None
+
+    async def aload(self) -> None:
+        if self._messages is None:
+            messages = await self._db.run(self._select_messages)
+            # messages might have been cleared while loading them
+            if self._messages is None:
+                self._messages = messages
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore
+        if self._messages is None:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                self._messages = self._db.run_sync(self._select_messages)
+            else:
+                raise RuntimeError(f"Chat history of session {self._session_id} used before loading it with aload")
+        return list(self._messages)
+
+    def _select_messages(self, conn: sqlite3.Connection) -> List[BaseMessage]:
+        rows = conn.execute("SELECT message FROM chat_messages WHERE session_id = ? ORDER BY id",
+                            (self._session_id,))
+        return messages_from_dict([json.loads(row[0]) for row in rows])
+
+    def add_message(self, message: BaseMessage) -> None:
+        # loads messages before adding to the pending ones, which are not yet in the database
+        self.messages
+        self._messages.append(message)
+        self._append(json.dumps(message_to_dict(message)))
+
+    async def aadd_message(self, message: BaseMessage) -> None:
+        self.add_message(message)
+        await self.aflush()
+
+    def clear(self) -> None:
+        self._messages = []
+        self._append(None)
+
+    def _append(self, item: Optional[str]) -> None:
+        self._pending.append(item)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            items = self._take_pending()
+            self._db.run_sync(lambda conn: self._write(conn, items))
+            return
+        if self._writer is None or self._writer.done():
+            self._writer = loop.create_task(self._write_pending_async())
+
+    async def _write_pending_async(self) -> None:
+        try:
+            while self._pending:
+                items = self._take_pending()
+                await self._db.run(lambda conn: self._write(conn, items))
+        except Exception as e:
+            logger.exception("Problem writing chat history for session %s", self._session_id, exc_info=e)
+
+    def _take_pending(self) -> List[Optional[str]]:
+        ret, self._pending = self._pending, []
+        return ret
+
+    def _write(self, conn: sqlite3.Connection, items: List[Optional[str]]) -> None:
+        rows = []
+        now = time.time()
+        for item in items:
+            if item is None:
+                rows = []
+                conn.execute("DELETE FROM chat_messages WHERE session_id = ?", (self._session_id,))
+            else:
+                rows.append((self._session_id, item, now))
+        conn.executemany(_INSERT_MESSAGE, rows)
+
+    async def aflush(self) -> None:
+        while self._writer is not None and not self._writer.done():
+            await self._writer
+
+
+class SessionRecords(NamedTuple):
+    session: Session
+    created_at: float
+    questions: List[Tuple[Question, float]]
+    messages: List[BaseMessage]
+
+
+class SqliteStorage(Storage):
+
+    def __init__(self, path: str, pool_size: int):
+        self._db = SqliteDatabase(path, pool_size)
+
+    async def start(self) -> None:
+        await self._db.run(lambda conn: conn.executescript(_SCHEMA))
+
+    async def stop(self) -> None:
+        self._db.close()
+
+    async def save_session(self, session: Session) -> None:
+        await self._db.run(lambda conn: conn.execute(
+            _UPSERT_SESSION, (str(session.id), session.user, session.model_dump_json(), time.time())))
+
+    async def find_session(self, session_id: str) -> Session | None:
+        session_uuid = uuid.UUID(session_id)
+        row = await self._db.run(lambda conn: conn.execute(
+            "SELECT data FROM sessions WHERE id = ?", (str(session_uuid),)).fetchone())
+        return Session.model_validate_json(row[0]) if row else None
+
+    async def save_question(self, question: Question) -> None:
+        await self._db.run(lambda conn: conn.execute(_INSERT_QUESTION, _question_row(question, time.time())))
+
+    async def save_questions(self, questions: List[Question]) -> List[Optional[BaseException]]:
+        # questions are inserted in one transaction, so either all of them are saved or an error is raised
+        now = time.time()
+        await self._db.run(lambda conn: conn.executemany(_INSERT_QUESTION, [_question_row(q, now) for q in questions]))
+        return [None] * len(questions)
+
+    def build_chat_history(self, session: Session) -> BaseChatMessageHistory:
+        return SqliteChatMessageHistory(self._db, session.id)
+
+    async def import_sessions(self, records: Iterable[SessionRecords]) -> int:
+        """Stores sessions in one transaction, skipping existing ones. Returns the number of imported sessions."""
+        records = list(records)
+        return await self._db.run(lambda conn: self._import_sessions(conn, records))
+
+    @staticmethod
+    def _import_sessions(conn: sqlite3.Connection, records: List[SessionRecords]) -> int:
+        ret = 0
+        for record in records:
+            session = record.session
+            cursor = conn.execute(
+                _IMPORT_SESSION, (str(session.id), session.user, session.model_dump_json(), record.created_at))
+            if not cursor.rowcount:
+                continue
+            conn.executemany(_INSERT_QUESTION, [_question_row(q, created_at) for q, created_at in record.questions])
+            conn.executemany(_INSERT_MESSAGE, [(str(session.id), json.dumps(message_to_dict(m)), record.created_at)
+                                               for m in record.messages])
+            ret += 1
+        return ret
+
+
+def _question_row(question: Question, created_at: float) -> tuple:
+    return str(question.id), str(question.session.id), question.question, question.answer, created_at
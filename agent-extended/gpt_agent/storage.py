@@ -0,0 +1,17 @@
+import os
+
+from gpt_agent.file_system_repos import FileSystemStorage
+from gpt_agent.repos import Storage
+from gpt_agent.sqlite_repos import SqliteStorage
+
+
+def _build_storage() -> Storage:
+    backend = os.getenv("STORAGE_BACKEND", "filesystem")
+    if backend == "sqlite":
+        return SqliteStorage(os.getenv("SQLITE_PATH", "sessions.db"), int(os.getenv("SQLITE_POOL_SIZE", "4")))
+    elif backend == "filesystem":
+        return FileSystemStorage()
+    raise ValueError(f"Unknown storage backend {backend}")
+
+
+storage = _build_storage()
@@ -0,0 +1,169 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+from langchain.tools import BaseTool
+from pydantic import BaseModel
+
+# This module is shared by agent-extended and agent-simple, so keep both copies in sync and don't
+# import anything from the agents.
+
+_POLICY_METADATA_KEY = "tool_cache_policy"
+_NEVER = "never"
+
+
+class ToolCachePolicy(NamedTuple):
+    # seconds results are reused after the tool returns them
+    ttl: float
+    # builds the cache key from the tool arguments, by default all of them are used
+    key: Optional[Callable[..., Hashable]] = None
+    # results of the tool kept at most, besides the global size of the cache
+    max_entries: Optional[int] = None
+
+
+def tool_cache(ttl: float, key: Optional[Callable[..., Hashable]] = None,
+               max_entries: Optional[int] = None) -> Callable[[BaseTool], BaseTool]:
+    """
+    Reuses results of a tool for calls with the same arguments, from any session, for `ttl` seconds.
+    Only tools built from functions (eg: with `@tool`) are supported, and errors are not cached.
+    """
+    def decorator(tool: BaseTool) -> BaseTool:
+        metadata = tool.metadata or {}
+        if metadata.get(_POLICY_METADATA_KEY) == _NEVER:
+            raise ValueError(f"Tool {tool.name} is marked with no_tool_cache")
+        policy = ToolCachePolicy(ttl, key, max_entries)
+        tool.metadata = {**metadata, _POLICY_METADATA_KEY: policy}
+        if getattr(tool, "func", None):
+            tool.func = _cached(tool.name, policy, tool.func)
+        if getattr(tool, "coroutine", None):
+            tool.coroutine = _cached_async(tool.name, policy, tool.coroutine)
+        return tool
+    return decorator
+
+
+def no_tool_cache(tool: BaseTool) -> BaseTool:
+    """Marks a tool whose results must never be reused (eg: clock), so no cache policy can be set on it."""
+    if isinstance((tool.metadata or {}).get(_POLICY_METADATA_KEY), ToolCachePolicy):
+        raise ValueError(f"Tool {tool.name} already has a cache policy")
+    tool.metadata = {**(tool.metadata or {}), _POLICY_METADATA_KEY: _NEVER}
+    return tool
+
+
+def get_tool_cache_policy(tool: BaseTool) -> Optional[ToolCachePolicy]:
+    policy = (tool.metadata or {}).get(_POLICY_METADATA_KEY)
+    return policy if isinstance(policy, ToolCachePolicy) else None
+
+
+class ToolCacheStats(BaseModel):
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    evictions: int
+    tool_hits: Dict[str, int]
+    tool_misses: Dict[str, int]
+
+
+_MISS = object()
+
+
+class ToolResultCache:
+    """
+    LRU cache of tool results shared by all cached tools, holding up to `max_size` results.
+
+    It is thread safe since sync tools may run in worker threads.
+    """
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Tuple[str, Hashable], Tuple[Any, float]] = OrderedDict()
+        self._tool_sizes: Dict[str, int] = {}
+        self._tool_stats: Dict[str, Tuple[int, int]] = {}
+        self._evictions = 0
+
+    def get(self, tool_name: str, key: Hashable) -> Any:
+        """Returns the cached result, or `_MISS` when there is no valid one."""
+        with self._lock:
+            hits, misses = self._tool_stats.get(tool_name, (0, 0))
+            entry = self._entries.get((tool_name, key))
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    self._remove((tool_name, key))
+                    self._evictions += 1
+                self._tool_stats[tool_name] = (hits, misses + 1)
+                return _MISS
+            self._entries.move_to_end((tool_name, key))
+            self._tool_stats[tool_name] = (hits + 1, misses)
+            return entry[0]
+
+    def put(self, tool_name: str, key: Hashable, value: Any, policy: ToolCachePolicy) -> None:
+        with self._lock:
+            entry_key = (tool_name, key)
+            if entry_key in self._entries:
+                self._remove(entry_key)
+            self._entries[entry_key] = (value, time.monotonic() + policy.ttl)
+            self._tool_sizes[tool_name] = self._tool_sizes.get(tool_name, 0) + 1
+            if policy.max_entries is not None and self._tool_sizes[tool_name] > policy.max_entries:
+                self._remove(next(k for k in self._entries if k[0] == tool_name))
+                self._evictions += 1
+            while len(self._entries) > self._max_size:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _remove(self, entry_key: Tuple[str, Hashable]) -> None:
+        del self._entries[entry_key]
+        self._tool_sizes[entry_key[0]] -= 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tool_sizes.clear()
+
+    def stats(self) -> ToolCacheStats:
+        with self._lock:
+            return ToolCacheStats(size=len(self._entries), max_size=self._max_size,
+                                  hits=sum(hits for hits, _ in self._tool_stats.values()),
+                                  misses=sum(misses for _, misses in self._tool_stats.values()),
+                                  evictions=self._evictions,
+                                  tool_hits={tool: hits for tool, (hits, _) in self._tool_stats.items()},
+                                  tool_misses={tool: misses for tool, (_, misses) in self._tool_stats.items()})
+
+
+def _build_key(policy: ToolCachePolicy, args: tuple, kwargs: Dict[str, Any]) -> Hashable:
+    # callbacks are provided by langchain on each call, and they don't change results
+    kwargs = {k: v for k, v in kwargs.items() if k != "callbacks"}
+    if policy.key:
+        return policy.key(*args, **kwargs)
+    return json.dumps([args, kwargs], sort_keys=True, default=str)
+
+
+def _cached(tool_name: str, policy: ToolCachePolicy, func: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        key = _build_key(policy, args, kwargs)
+        ret = tool_result_cache.get(tool_name, key)
+        if ret is _MISS:
+            ret = func(*args, **kwargs)
+            tool_result_cache.put(tool_name, key, ret, policy)
+        return ret
+    return wrapper
+
+
+def _cached_async(tool_name: str, policy: ToolCachePolicy, func: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        key = _build_key(policy, args, kwargs)
+        ret = tool_result_cache.get(tool_name, key)
+        if ret is _MISS:
+            ret = await func(*args, **kwargs)
+            tool_result_cache.put(tool_name, key, ret, policy)
+        return ret
+    return wrapper
+
+
+tool_result_cache = ToolResultCache(int(os.getenv("TOOL_CACHE_MAX_SIZE", "1024")))
@@ -0,0 +1,89 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple
+
+from langchain.tools import BaseTool, StructuredTool, Tool
+from pydantic import BaseModel
+
+_TIMEOUT_METADATA_KEY = "tool_timeout"
+
+
+def tool_timeout(seconds: float) -> Callable[[BaseTool], BaseTool]:
+    """Sets the seconds a tool can run, overriding the dispatcher default timeout."""
+    def decorator(tool: BaseTool) -> BaseTool:
+        tool.metadata = {**(tool.metadata or {}), _TIMEOUT_METADATA_KEY: seconds}
+        return tool
+    return decorator
+
+
+class ToolCall(NamedTuple):
+    tool: BaseTool
+    tool_input: str | Dict[str, Any]
+
+
+class ToolDispatchStats(BaseModel):
+    running: int
+    max_workers: int
+    calls: int
+    timed_out: int
+
+
+class ToolDispatcher:
+    """
+    Runs tool calls requested by the model in the same step concurrently, so a step takes as long
+    as its slowest tool.
+
+    Async tools run in the event loop and sync ones in a pool of up to `max_workers` threads, so
+    they don't block the loop. Calls taking longer than their timeout are abandoned and the model
+    gets a timeout message as their result (threads of sync tools can't be interrupted, so they
+    keep a worker until they end).
+    """
+
+    def __init__(self, max_workers: int, timeout: float):
+        self._max_workers = max_workers
+        self._timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="tool")
+        self._running = 0
+        self._calls = 0
+        self._timed_out = 0
+
+    async def dispatch(self, calls: List[ToolCall]) -> List[str]:
+        """Returns the result of each call, in the same order as calls."""
+        return list(await asyncio.gather(*(self._call(call) for call in calls)))
+
+    async def _call(self, call: ToolCall) -> str:
+        timeout = (call.tool.metadata or {}).get(_TIMEOUT_METADATA_KEY, self._timeout)
+        self._calls += 1
+        self._running += 1
+        try:
+            return str(await asyncio.wait_for(self._run(call), timeout))
+        except asyncio.TimeoutError:
+            self._timed_out += 1
+            return f"{call.tool.name} did not respond in {timeout} seconds."
+        finally:
+            self._running -= 1
+
+    async def _run(self, call: ToolCall) -> Any:
+        if _is_async(call.tool):
+            return await call.tool.arun(call.tool_input)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(call.tool.run, call.tool_input))
+
+    def stats(self) -> ToolDispatchStats:
+        return ToolDispatchStats(running=self._running, max_workers=self._max_workers, calls=self._calls,
+                                 timed_out=self._timed_out)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _is_async(tool: BaseTool) -> bool:
+    if isinstance(tool, (Tool, StructuredTool)):
+        return tool.coroutine is not None
+    return type(tool)._arun is not BaseTool._arun
+
+
+tool_dispatcher = ToolDispatcher(int(os.getenv("TOOL_MAX_WORKERS", "8")),
+                                 float(os.getenv("TOOL_TIMEOUT_SECONDS", "30")))
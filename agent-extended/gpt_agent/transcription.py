@@ -0,0 +1,32 @@
+import asyncio
+import os
+import pathlib
+
+from gpt_agent.clients import client_registry, whisper_endpoint
+from gpt_agent.domain import Session
+
+
+class Transcriber:
+    """
+    Transcribes audios with the async OpenAI client, so transcriptions never block the event loop,
+    limiting concurrent transcriptions so they don't take over connections used by questions.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def transcript(self, session: Session, audio_file_path: str) -> str:
+        locale = session.locales[0]
+        lang_separator_pos = locale.find("-")
+        language = locale[0:lang_separator_pos] if lang_separator_pos >= 0 else locale
+        client = client_registry.get_async_client(whisper_endpoint())
+        async with self._semaphore:
+            # the client reads the audio (without blocking the event loop) when sending it, so audios
+            # waiting for their turn are not kept in memory
+            ret = await client.audio.transcriptions.create(
+                model="whisper-1", file=pathlib.Path(audio_file_path), language=language
+            )
+        return ret.text
+
+
+transcriber = Transcriber(int(os.getenv("TRANSCRIPTION_MAX_CONCURRENCY", "4")))
@@ -0,0 +1,163 @@
+import asyncio
+from typing import Dict, List
+
+import pytest
+
+from gpt_agent.admission import AdmissionController, AdmissionRejectedError, Priority
+
+
+def _build_controller(max_active: int = 1, max_queued: int = 10, queue_timeout: float = 5, user_burst: float = 100,
+                      priority_limits: Dict[Priority, int] | None = None) -> AdmissionController:
+    return AdmissionController(max_active, max_queued, queue_timeout, user_rate=1 / 60, user_burst=user_burst,
+                               priority_limits=priority_limits or {})
+
+
+async def _settle() -> None:
+    # lets queued tasks run until they wait for admission
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_slot_is_handed_to_next_waiter_when_waiter_is_cancelled():
+    async def run():
+        controller = _build_controller()
+        permit = await controller.acquire("a")
+        cancelled = asyncio.create_task(controller.acquire("b"))
+        waiting = asyncio.create_task(controller.acquire("c"))
+        await _settle()
+        cancelled.cancel()
+        await _settle()
+        assert controller.stats().queued == 1
+        permit.release()
+        (await waiting).release()
+        assert cancelled.cancelled()
+        stats = controller.stats()
+        assert (stats.active, stats.queued) == (0, 0)
+
+    asyncio.run(run())
+
+
+def test_slot_transferred_to_cancelled_waiter_is_handed_to_next_one():
+    async def run():
+        controller = _build_controller()
+        permit = await controller.acquire("a")
+        cancelled = asyncio.create_task(controller.acquire("b"))
+        waiting = asyncio.create_task(controller.acquire("c"))
+        await _settle()
+        # the slot is transferred to the first waiter, which is cancelled before it resumes
+        permit.release()
+        cancelled.cancel()
+        (await waiting).release()
+        assert cancelled.cancelled()
+        stats = controller.stats()
+        assert (stats.active, stats.queued) == (0, 0)
+
+    asyncio.run(run())
+
+
+def test_waiter_is_rejected_on_timeout_and_queue_is_emptied():
+    async def run():
+        controller = _build_controller(queue_timeout=0.01)
+        permit = await controller.acquire("a")
+        with pytest.raises(AdmissionRejectedError):
+            await controller.acquire("b")
+        permit.release()
+        stats = controller.stats()
+        assert (stats.active, stats.queued, stats.timed_out) == (0, 0, 1)
+        (await controller.acquire("b")).release()
+
+    asyncio.run(run())
+
+
+def test_full_queue_rejects_right_away():
+    async def run():
+        controller = _build_controller(max_queued=1)
+        permit = await controller.acquire("a")
+        waiting = asyncio.create_task(controller.acquire("b"))
+        await _settle()
+        with pytest.raises(AdmissionRejectedError):
+            await controller.acquire("c")
+        assert controller.stats().rejected == 1
+        permit.release()
+        (await waiting).release()
+
+    asyncio.run(run())
+
+
+def test_priority_limit_keeps_capacity_for_questions():
+    async def run():
+        controller = _build_controller(max_active=2, priority_limits={Priority.TRANSCRIPTION: 1})
+        transcription = await controller.acquire("a", Priority.TRANSCRIPTION)
+        waiting_transcription = asyncio.create_task(controller.acquire("b", Priority.TRANSCRIPTION))
+        await _settle()
+        question = await asyncio.wait_for(controller.acquire("c"), 1)
+        assert not waiting_transcription.done()
+        assert controller.stats().active_by_priority == {"interactive": 1, "transcription": 1, "background": 0}
+        transcription.release()
+        (await waiting_transcription).release()
+        question.release()
+
+    asyncio.run(run())
+
+
+def test_waiting_users_are_admitted_fairly():
+    async def run():
+        controller = _build_controller()
+        permit = await controller.acquire("other")
+        admitted: List[str] = []
+
+        async def acquire(user: str, name: str) -> None:
+            ret = await controller.acquire(user)
+            admitted.append(name)
+            ret.release()
+
+        tasks = [asyncio.create_task(acquire("heavy", f"heavy{i}")) for i in range(3)]
+        await _settle()
+        tasks.append(asyncio.create_task(acquire("light", "light")))
+        await _settle()
+        permit.release()
+        await asyncio.gather(*tasks)
+        # the light user doesn't wait for all the work queued before by the heavy one
+        assert admitted == ["heavy0", "light", "heavy1", "heavy2"]
+
+    asyncio.run(run())
+
+
+def test_rate_limit_rejects_users_exceeding_burst():
+    async def run():
+        controller = _build_controller(max_active=10, user_burst=2)
+        permits = [await controller.acquire("a"), await controller.acquire("a")]
+        with pytest.raises(AdmissionRejectedError) as e:
+            await controller.acquire("a")
+        assert e.value.retry_after > 0
+        (await controller.acquire("b")).release()
+        assert controller.stats().rate_limited == 1
+        for permit in permits:
+            permit.release()
+
+    asyncio.run(run())
+
+
+def test_token_is_refunded_when_work_is_rejected():
+    async def run():
+        controller = _build_controller(queue_timeout=0.01, user_burst=1)
+        permit = await controller.acquire("other")
+        with pytest.raises(AdmissionRejectedError):
+            await controller.acquire("a")
+        permit.release()
+        # the only token of the user was given back when the work timed out
+        (await controller.acquire("a")).release()
+        assert controller.stats().rate_limited == 0
+
+    asyncio.run(run())
+
+
+def test_background_work_is_not_rate_limited():
+    async def run():
+        controller = _build_controller(max_active=10, user_burst=1)
+        permits = [await controller.acquire("a", Priority.BACKGROUND) for _ in range(3)]
+        (await controller.acquire("a")).release()
+        for permit in permits:
+            permit.release()
+
+    asyncio.run(run())
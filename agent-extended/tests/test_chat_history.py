@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, message_to_dict
+
+from gpt_agent.chat_history import JsonlChatMessageHistory
+
+
+def _contents(messages) -> list:
+    return [m.content for m in messages]
+
+
+def test_messages_are_read_after_clear(tmp_path):
+    path = str(tmp_path / "history.jsonl")
+    history = JsonlChatMessageHistory(path)
+    history.add_message(HumanMessage(content="a"))
+    history.clear()
+    history.add_message(HumanMessage(content="b"))
+    history.add_message(AIMessage(content="c"))
+    assert _contents(history.messages) == ["b", "c"]
+    assert _contents(history.tail(1)) == ["c"]
+    reloaded = JsonlChatMessageHistory(path)
+    assert _contents(reloaded.tail(5)) == ["b", "c"]
+    assert _contents(reloaded.messages) == ["b", "c"]
+
+
+def test_file_is_compacted_keeping_offsets(tmp_path):
+    path = tmp_path / "history.jsonl"
+    history = JsonlChatMessageHistory(str(path), compact_threshold=3)
+    history.add_message(HumanMessage(content="a"))
+    history.add_message(HumanMessage(content="b"))
+    history.clear()
+    history.add_message(HumanMessage(content="c"))
+    assert len(path.read_text().splitlines()) == 1
+    history.add_message(AIMessage(content="d"))
+    assert _contents(history.tail(2)) == ["c", "d"]
+    assert _contents(JsonlChatMessageHistory(str(path)).tail(1)) == ["d"]
+
+
+def test_legacy_history_is_imported(tmp_path):
+    legacy = [message_to_dict(HumanMessage(content="a")), message_to_dict(AIMessage(content="b"))]
+    (tmp_path / "history.json").write_text(json.dumps(legacy))
+    history = JsonlChatMessageHistory(str(tmp_path / "history.jsonl"))
+    assert _contents(history.messages) == ["a", "b"]
+    assert (tmp_path / "history.jsonl").exists()
+
+
+def test_history_is_loaded_in_event_loop_with_aload(tmp_path):
+    path = str(tmp_path / "history.jsonl")
+    JsonlChatMessageHistory(path).add_message(HumanMessage(content="a"))
+
+    async def run():
+        history = JsonlChatMessageHistory(path, compact_threshold=1)
+        with pytest.raises(RuntimeError):
+            history.messages
+        await history.aload()
+        history.add_message(AIMessage(content="b"))
+        assert _contents(history.messages) == ["a", "b"]
+        history.clear()
+        history.add_message(HumanMessage(content="c"))
+        await history.aflush()
+        assert _contents(history.tail(5)) == ["c"]
+        return history
+
+    history = asyncio.run(run())
+    assert _contents(JsonlChatMessageHistory(path).messages) == ["c"]
+    # changes of other processes are loaded after refreshing
+    JsonlChatMessageHistory(path).add_message(AIMessage(content="d"))
+    history.refresh()
+    asyncio.run(history.aload())
+    assert _contents(history.messages) == ["c", "d"]
@@ -0,0 +1,102 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from gpt_agent.coalescing import Coalescer
+
+
+def test_subscribers_share_one_run():
+    async def run():
+        coalescer = Coalescer(True)
+        runs = 0
+
+        async def produce(publish):
+            nonlocal runs
+            runs += 1
+            await asyncio.sleep(0)
+            publish("a")
+            publish("b")
+            return "result"
+
+        async def consume() -> List[str]:
+            return [item async for item in coalescer.subscribe("key", produce)]
+
+        assert await asyncio.gather(consume(), consume()) == [["a", "b"], ["a", "b"]]
+        stats = coalescer.stats()
+        assert (runs, stats.started, stats.joined, stats.in_flight) == (1, 1, 1, 0)
+
+    asyncio.run(run())
+
+
+def test_producer_is_cancelled_when_last_subscriber_leaves():
+    async def run():
+        coalescer = Coalescer(True)
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def produce(publish):
+            publish("a")
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def consume_first(subscription):
+            async for _ in subscription:
+                return
+
+        subscriptions = [coalescer.subscribe("key", produce), coalescer.subscribe("key", produce)]
+        await started.wait()
+        await consume_first(subscriptions[0])
+        assert not cancelled.is_set()
+        await consume_first(subscriptions[1])
+        await asyncio.wait_for(cancelled.wait(), 1)
+        stats = coalescer.stats()
+        assert (stats.cancelled, stats.in_flight) == (1, 0)
+
+    asyncio.run(run())
+
+
+def test_leader_waits_for_producer_even_when_cancelled():
+    async def run():
+        coalescer = Coalescer(True)
+        release = asyncio.Event()
+
+        async def produce(publish):
+            await release.wait()
+            return "result"
+
+        subscription = coalescer.subscribe("key", produce)
+        follower = coalescer.subscribe("key", produce)
+        assert subscription.leader and not follower.leader
+        waiter = asyncio.create_task(subscription.wait_done())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert subscription.result == "result"
+        assert coalescer.stats().cancelled == 0
+
+    asyncio.run(run())
+
+
+def test_disabled_coalescer_runs_each_subscription():
+    async def run():
+        coalescer = Coalescer(False)
+
+        async def produce(publish):
+            publish("a")
+
+        subscriptions = [coalescer.subscribe("key", produce), coalescer.subscribe("key", produce)]
+        assert all(s.leader for s in subscriptions)
+        for subscription in subscriptions:
+            assert [item async for item in subscription] == ["a"]
+        assert coalescer.stats().started == 2
+
+    asyncio.run(run())
@@ -0,0 +1,76 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from langchain_core.chat_history import BaseChatMessageHistory
+
+from gpt_agent import question_writer as question_writer_module
+from gpt_agent.domain import Question, Session
+from gpt_agent.question_writer import QuestionWriter
+from gpt_agent.repos import Storage
+
+
+class _FlakyStorage(Storage):
+    """Fails to save each question the given number of times."""
+
+    def __init__(self, failures: Dict[str, int]):
+        self.failures = failures
+        self.attempts: List[List[str]] = []
+        self.saved: List[str] = []
+
+    async def save_session(self, session: Session) -> None:
+        pass
+
+    async def find_session(self, session_id: str) -> Session | None:
+        return None
+
+    async def save_question(self, question: Question) -> None:
+        pass
+
+    async def save_questions(self, questions: List[Question]) -> List[Optional[BaseException]]:
+        self.attempts.append([q.question for q in questions])
+        ret = []
+        for question in questions:
+            if self.failures.get(question.question, 0):
+                self.failures[question.question] -= 1
+                ret.append(IOError(f"Can't save {question.question}"))
+            else:
+                self.saved.append(question.question)
+                ret.append(None)
+        return ret
+
+    def build_chat_history(self, session: Session) -> BaseChatMessageHistory:
+        raise NotImplementedError()
+
+
+def _write(storage: Storage, questions: List[str], max_attempts: int = 3) -> QuestionWriter:
+    session = Session(locales=["en"], user="user")
+
+    async def run():
+        writer = QuestionWriter(storage, max_queue_size=10, batch_size=10, flush_period=0.01,
+                                max_attempts=max_attempts)
+        writer.start()
+        for question in questions:
+            await writer.put(Question(session=session, question=question, answer=""))
+        await writer.stop()
+        return writer
+
+    return asyncio.run(run())
+
+
+def test_only_failed_questions_are_retried(monkeypatch):
+    monkeypatch.setattr(question_writer_module, "_RETRY_DELAY_SECONDS", 0)
+    storage = _FlakyStorage({"b": 1, "c": 2})
+    writer = _write(storage, ["a", "b", "c"])
+    assert storage.attempts == [["a", "b", "c"], ["b", "c"], ["c"]]
+    assert storage.saved == ["a", "b", "c"]
+    stats = writer.stats()
+    assert (stats.written, stats.retried, stats.failed) == (3, 3, 0)
+
+
+def test_questions_failing_all_attempts_are_dropped(monkeypatch):
+    monkeypatch.setattr(question_writer_module, "_RETRY_DELAY_SECONDS", 0)
+    storage = _FlakyStorage({"b": 5})
+    writer = _write(storage, ["a", "b"], max_attempts=2)
+    assert storage.attempts == [["a", "b"], ["b"]]
+    stats = writer.stats()
+    assert (stats.written, stats.retried, stats.failed, stats.queued) == (1, 1, 1, 0)
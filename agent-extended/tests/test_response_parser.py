@@ -0,0 +1,109 @@
+import re
+import time
+from typing import List
+
+import pytest
+
+from gpt_agent.response_parser import COT, FINAL_ANSWER, StreamingResponseParser, parse_response
+
+
+def _step(action: str, value: str) -> dict:
+    return {"action": action, "value": value}
+
+
+def _stream(text: str, token_size: int) -> List[dict | str]:
+    parser = StreamingResponseParser(dict)
+    ret = []
+    for i in range(0, len(text), token_size):
+        ret.extend(parser.feed(text[i:i + token_size]))
+    ret.extend(parser.finish())
+    return ret
+
+
+def _merge_chunks(items: List[dict | str]) -> List[dict | str]:
+    # final answer and plain text chunks are joined, since they are generated in as many chunks as tokens arrive
+    ret = []
+    for item in items:
+        if ret and isinstance(item, str) and isinstance(ret[-1], str):
+            ret[-1] += item
+        elif (ret and isinstance(item, dict) and isinstance(ret[-1], dict)
+              and item["action"] == ret[-1]["action"] == FINAL_ANSWER):
+            ret[-1] = _step(FINAL_ANSWER, ret[-1]["value"] + item["value"])
+        else:
+            ret.append(item)
+    return ret
+
+
+def _client_final_answer(items: List[dict | str]) -> str:
+    # same as the browser extension, which strips leading whitespace of each final answer chunk
+    return "".join(re.sub(r"^\s*", "", item["value"]) for item in items
+                   if isinstance(item, dict) and item["action"] == FINAL_ANSWER)
+
+
+RESPONSES = [
+    "RAZONAMIENTO:\n1. Primer paso.\n2. Segundo paso.\n\nRESPUESTA FINAL:\nLa respuesta.",
+    "RAZONAMIENTO: Una oración. Otra oración.\nRESPUESTA FINAL: La respuesta.\n",
+    "Claro, veamos.\nRAZONAMIENTO:\n1. Paso.\nRESPUESTA FINAL:\nListo.",
+    "RAZONAMIENTO:\n1. Paso sin respuesta.\n2. Otro paso.\n",
+    "Una respuesta sin formato.\n\nCon dos párrafos.",
+    "data: RAZONAMIENTO:\ndata: - Paso.\ndata: RESPUESTA FINAL:\ndata: Listo.",
+    "RAZONAMIENTO:\n- Paso.\nRESPUESTA FINAL:\nPrimer párrafo.\n\nSegundo:\n- a\n  - b\n",
+    "RAZONAMIENTO: " + "Una oración larga: sin saltos de línea. " * 10 + "RESPUESTA FINAL: Listo.",
+    "RAZONAMIENTO: " + "Una oración larga. " * 10 + "xRESPUESTA FINAL: Sigue. RESPUESTA  FINAL : Listo.",
+    "- RAZONAMIENTO:\n- ",
+    "a. RAZONAMIENTO: a.",
+    "data: ",
+    "\n\ndata: data: ",
+]
+
+
+@pytest.mark.parametrize("response", RESPONSES)
+@pytest.mark.parametrize("token_size", [1, 2, 3, 7])
+def test_streaming_matches_complete_response(response: str, token_size: int):
+    assert _merge_chunks(_stream(response, token_size)) == _merge_chunks(parse_response(response, dict))
+
+
+@pytest.mark.parametrize("token_size", [1, 2, 3, 7])
+def test_final_answer_chunks_keep_blank_lines_and_indentation(token_size: int):
+    items = _stream("RAZONAMIENTO:\n- Paso.\nRESPUESTA FINAL:\nPrimer párrafo.\n\nSegundo:\n- a\n  - b\n", token_size)
+    assert _client_final_answer(items) == "Primer párrafo.\n\nSegundo:\n- a\n  - b"
+    assert all(item["value"].strip() for item in items if isinstance(item, dict))
+
+
+def test_text_before_reasoning_is_reasoning():
+    assert parse_response("Claro, veamos.\nRAZONAMIENTO:\n1. Paso.\nRESPUESTA FINAL:\nListo.", dict) == [
+        _step(COT, "Claro, veamos."), _step(COT, "Paso."), _step(FINAL_ANSWER, "Listo.")]
+
+
+@pytest.mark.parametrize("token_size", [1, 4])
+def test_reasoning_without_final_answer_ends_with_last_step(token_size: int):
+    items = _stream("RAZONAMIENTO:\n1. Paso.\n2. Otro paso.\n", token_size)
+    assert items == [_step(COT, "Paso."), "Otro paso."]
+
+
+def test_single_line_reasoning_without_final_answer_is_the_answer():
+    assert parse_response("RAZONAMIENTO: Una oración. Otra oración.", dict) == ["Una oración. Otra oración."]
+
+
+def test_text_without_markers_is_not_held():
+    parser = StreamingResponseParser(dict)
+    text = "Una línea: con dos puntos.\n" * 100
+    items = [item for i in range(0, len(text), 4) for item in parser.feed(text[i:i + 4])]
+    assert len("".join(items)) > len(text) / 2
+    assert "".join(items + parser.finish()) == text
+
+
+def test_marker_after_preamble_limit_is_text():
+    response = "x" * 2000 + "\nRAZONAMIENTO:\n- Paso.\nRESPUESTA FINAL:\nListo."
+    assert _merge_chunks(_stream(response, 4)) == [response]
+
+
+@pytest.mark.parametrize("response", [
+    "Una línea: con dos puntos. " * 20000,
+    "RAZONAMIENTO: " + "Una oración: con dos puntos. " * 20000 + "\nRESPUESTA FINAL: Listo.",
+], ids=["plain", "single line reasoning"])
+def test_long_responses_are_parsed_in_linear_time(response: str):
+    start = time.perf_counter()
+    _stream(response, 4)
+    # a quadratic parse takes several seconds
+    assert time.perf_counter() - start < 1
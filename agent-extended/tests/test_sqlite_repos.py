@@ -0,0 +1,72 @@
+import asyncio
+import uuid
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from gpt_agent.domain import Question, Session
+from gpt_agent.sqlite_repos import SqliteStorage
+
+
+def _contents(messages) -> list:
+    return [m.content for m in messages]
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    ret = SqliteStorage(str(tmp_path / "sessions.db"), 2)
+    asyncio.run(ret.start())
+    yield ret
+    asyncio.run(ret.stop())
+
+
+def test_sessions_and_questions_are_saved(sqlite_storage):
+    session = Session(locales=["en"], user="user")
+
+    async def run():
+        await sqlite_storage.save_session(session)
+        question = Question(session=session, question="q", answer="a")
+        assert await sqlite_storage.save_questions([question]) == [None]
+        # saving the same question again is ignored
+        await sqlite_storage.save_question(question)
+        assert await sqlite_storage.find_session(str(session.id)) == session
+        assert await sqlite_storage.find_session(str(uuid.uuid4())) is None
+
+    asyncio.run(run())
+
+
+def test_history_writes_pending_messages_and_clears(sqlite_storage):
+    session = Session(locales=["en"], user="user")
+
+    async def run():
+        history = sqlite_storage.build_chat_history(session)
+        with pytest.raises(RuntimeError):
+            history.messages
+        await history.aload()
+        history.add_message(HumanMessage(content="a"))
+        history.clear()
+        history.add_message(HumanMessage(content="b"))
+        history.add_message(AIMessage(content="c"))
+        # pending messages are part of the history before being written
+        assert _contents(history.messages) == ["b", "c"]
+        await history.aflush()
+        reloaded = sqlite_storage.build_chat_history(session)
+        await reloaded.aload()
+        assert _contents(reloaded.messages) == ["b", "c"]
+
+        history.clear()
+        await history.aadd_message(HumanMessage(content="d"))
+        reloaded.refresh()
+        await reloaded.aload()
+        assert _contents(reloaded.messages) == ["d"]
+
+    asyncio.run(run())
+
+
+def test_history_is_written_right_away_without_event_loop(sqlite_storage):
+    session = Session(locales=["en"], user="user")
+    history = sqlite_storage.build_chat_history(session)
+    history.add_message(HumanMessage(content="a"))
+    history.clear()
+    history.add_message(AIMessage(content="b"))
+    assert _contents(sqlite_storage.build_chat_history(session).messages) == ["b"]
@@ -1,33 +1,16 @@
+import asyncio
 import os
-import re
-from typing import List
+from typing import AsyncIterator, Dict, List
 
 from langchain.agents import AgentExecutor, create_openai_functions_agent
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_community.chat_models import ChatOpenAI
 
 from models import AgentStep, QuestionResponse
+from response_parser import FINAL_ANSWER, parse_response, replace_placeholders
+from session_memory import session_memory
 from tools import clock
 
-_BULLET_RE = re.compile(r"^\s*(?:\d+[\.\-\)]|[•\-])\s*", re.MULTILINE)
-_RE_FINAL = re.compile(r"\bRESPUESTA\s+FINAL\s*:\s*", re.I)
-_RE_REASONING = re.compile(r"\bRAZONAMIENTO\s*:\s*", re.I)
-
-
-def split_numbered_cot(cot_block: str) -> List[str]:
-    steps, current = [], []
-    for line in cot_block.splitlines():
-        if _BULLET_RE.match(line):
-            if current:
-                steps.append(" ".join(current).strip())
-                current = []
-            line = _BULLET_RE.sub("", line, count=1)
-        current.append(line.strip())
-    if current:
-        steps.append(" ".join(current).strip())
-    return [s for s in steps if s]
-
-
 SYSTEM_PROMPT = """
 Eres un asistente IA experto.
 Siempre que respondas, sigue EXACTAMENTE este formato:
@@ -68,42 +51,48 @@ def build_agent() -> AgentExecutor:
     return agent_executor
 
 
-def process_question(agent: AgentExecutor, question: str) -> QuestionResponse:
-    result = agent.invoke({"input": question, "chat_history": []})
+def process_question(agent: AgentExecutor, session_id: str, question: str) -> QuestionResponse:
+    chat_history = session_memory.get_history(session_id)
+    result = agent.invoke({"input": question, "chat_history": chat_history})
+    session_memory.add_exchange(session_id, question, result["output"])
 
     steps: list[AgentStep] = []
     observation_map = {}
 
     # Guardamos observaciones por acción para luego reemplazos
-    for idx, (action, observation) in enumerate(result.get("intermediate_steps", [])):
-        # Guardamos también como cot para mostrar razonamiento
-        steps.append(AgentStep(action="cot", value=action.log.strip()))
-        steps.append(AgentStep(action="cot", value=str(observation).strip()))
-
-        # Mapeamos para reemplazo, por ejemplo usando nombre o índice
-        observation_map[action.log.strip()] = str(observation).strip()
-
-    raw_output: str = result["output"]
+    for action, observation in result.get("intermediate_steps", []):
+        steps.extend(_build_intermediate_steps(action.log, observation, observation_map))
 
-    # Reemplazar placeholders en raw_output con observaciones reales
-    for placeholder, real_value in observation_map.items():
-        if placeholder in raw_output:
-            raw_output = raw_output.replace(placeholder, real_value)
-
-    parts = _RE_FINAL.split(raw_output, maxsplit=1)
-
-    if len(parts) == 2:
-        cot_block, final_answer = parts
-        cot_block = _RE_REASONING.sub("", cot_block).strip()
-
-        if _BULLET_RE.match(cot_block):
-            for sub in split_numbered_cot(cot_block):
-                steps.append(AgentStep(action="cot", value=sub))
-        elif cot_block:
-            steps.append(AgentStep(action="cot", value=cot_block))
+    steps.extend(_build_output_steps(result["output"], observation_map))
+    return QuestionResponse(steps=steps)
 
-        steps.append(AgentStep(action="final_answer", value=final_answer.strip()))
-    else:
-        steps.append(AgentStep(action="final_answer", value=raw_output.strip()))
 
-    return QuestionResponse(steps=steps)
+async def astream_question(agent: AgentExecutor, session_id: str, question: str) -> AsyncIterator[QuestionResponse]:
+    """Answers a question without blocking the event loop, yielding steps as soon as the agent takes them."""
+    # session memory might read or write snapshots
+    chat_history = await asyncio.to_thread(session_memory.get_history, session_id)
+    observation_map = {}
+    async for chunk in agent.astream({"input": question, "chat_history": chat_history}):
+        for step in chunk.get("steps", []):
+            yield QuestionResponse(steps=_build_intermediate_steps(step.action.log, step.observation, observation_map))
+        if "output" in chunk:
+            await asyncio.to_thread(session_memory.add_exchange, session_id, question, chunk["output"])
+            yield QuestionResponse(steps=_build_output_steps(chunk["output"], observation_map))
+
+
+def _build_intermediate_steps(log: str, observation: object, observation_map: Dict[str, str]) -> List[AgentStep]:
+    # Mapeamos para reemplazo, por ejemplo usando nombre o índice
+    observation_map[log.strip()] = str(observation).strip()
+    # Guardamos también como cot para mostrar razonamiento
+    return [AgentStep(action="cot", value=log.strip()), AgentStep(action="cot", value=str(observation).strip())]
+
+
+def _build_output_steps(output: str, observation_map: Dict[str, str]) -> List[AgentStep]:
+    raw_output = replace_placeholders(output, observation_map)
+    steps = []
+    for item in parse_response(raw_output, AgentStep):
+        if isinstance(item, AgentStep):
+            steps.append(item)
+        elif item.strip():
+            steps.append(AgentStep(action=FINAL_ANSWER, value=item.strip()))
+    return steps
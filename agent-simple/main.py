@@ -1,15 +1,39 @@
+import asyncio
 import dotenv
+import logging
 import os
+from typing import AsyncIterator, Optional
+
 from fastapi import FastAPI, status
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi import HTTPException
+from langchain.agents import AgentExecutor
 
 import uvicorn
 
 from models import SessionBase, Session, QuestionRequest
 import agent_logic
+from session_memory import session_memory
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
+# with async mode answers are streamed and many questions can be answered at the same time,
+# otherwise each answer is returned at once and computed in a worker thread
+async_mode = os.getenv("AGENT_ASYNC", "true").lower() == "true"
+# the agent holds no conversation state, so it is shared by all questions
+agent: Optional[AgentExecutor] = None
+
+
+@app.on_event("startup")
+async def build_agent():
+    global agent
+    agent = agent_logic.build_agent()
+
+
+@app.on_event("shutdown")
+async def snapshot_sessions():
+    await asyncio.to_thread(session_memory.snapshot_all)
 
 
 @app.get("/manifest.json")
@@ -29,14 +53,28 @@ async def create_session(req: SessionBase) -> Session:
 
 @app.post("/sessions/{session_id}/questions", status_code=status.HTTP_200_OK)
 async def answer_question(session_id: str, req: QuestionRequest):
-    agent = agent_logic.build_agent()
+    if async_mode:
+        return StreamingResponse(answer_stream(session_id, req.question or ""), media_type="text/event-stream")
     try:
-        response = agent_logic.process_question(agent, req.question or "")
+        response = await asyncio.to_thread(agent_logic.process_question, agent, session_id, req.question or "")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     return response
 
 
+async def answer_stream(session_id: str, question: str) -> AsyncIterator[str]:
+    try:
+        async for response in agent_logic.astream_question(agent, session_id, question):
+            yield _server_sent_event("flow", response.model_dump_json())
+    except Exception:
+        logger.exception("Problem answering question")
+        yield _server_sent_event("error", "")
+
+
+def _server_sent_event(event: str, data: str) -> str:
+    return f"event: {event}\r\ndata: {data}\r\n\r\n"
+
+
 if __name__ == "__main__":
     dotenv.load_dotenv()
     os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
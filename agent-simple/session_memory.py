@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, messages_from_dict, messages_to_dict
+
+logger = logging.getLogger(__name__)
+
+
+class _SessionBuffer:
+
+    def __init__(self, messages: Deque[BaseMessage]):
+        self.messages = messages
+        self.chars = sum(_message_chars(m) for m in messages)
+        self.last_used = time.monotonic()
+
+
+def _message_chars(message: BaseMessage) -> int:
+    return len(message.content) if isinstance(message.content, str) else len(json.dumps(message.content))
+
+
+class SessionMemory:
+    """
+    Keeps the most recent `max_messages` messages of each session in memory, so follow-up questions
+    get the conversation context.
+
+    Sessions not used for `idle_ttl` seconds are evicted, as well as least recently used sessions
+    when the content of all messages exceeds `max_total_chars`. When `snapshot_path` is set, evicted
+    sessions (and all sessions on `snapshot_all`) are saved in it, and restored when used again.
+    Snapshots are read and written without holding the lock, and callers in the event loop should
+    use this class from a worker thread when snapshots are enabled.
+    """
+
+    def __init__(self, max_messages: int, idle_ttl: float, max_total_chars: int,
+                 snapshot_path: Optional[str] = None):
+        self._max_messages = max_messages
+        self._idle_ttl = idle_ttl
+        self._max_total_chars = max_total_chars
+        self._snapshot_path = snapshot_path
+        self._lock = threading.Lock()
+        self._sessions: OrderedDict[str, _SessionBuffer] = OrderedDict()
+        self._total_chars = 0
+        # messages of evicted sessions being saved, which are used if sessions are used again meanwhile
+        self._saving: Dict[str, List[BaseMessage]] = {}
+
+    def get_history(self, session_id: str) -> List[BaseMessage]:
+        self._ensure_loaded(session_id)
+        with self._lock:
+            ret = list(self._get_buffer(session_id).messages)
+            evicted = self._evict_idle()
+        self._save_snapshots(evicted)
+        return ret
+
+    def add_exchange(self, session_id: str, question: str, answer: str) -> None:
+        self._ensure_loaded(session_id)
+        with self._lock:
+            buffer = self._get_buffer(session_id)
+            for message in (HumanMessage(content=question), AIMessage(content=answer)):
+                if len(buffer.messages) == buffer.messages.maxlen:
+                    self._remove_chars(buffer, _message_chars(buffer.messages[0]))
+                buffer.messages.append(message)
+                self._add_chars(buffer, _message_chars(message))
+            evicted = self._evict_idle() + self._evict_exceeding()
+        self._save_snapshots(evicted)
+
+    def snapshot_all(self) -> None:
+        if not self._snapshot_path:
+            return
+        with self._lock:
+            sessions = [(session_id, list(buffer.messages)) for session_id, buffer in self._sessions.items()]
+        self._save_snapshots(sessions)
+
+    def _ensure_loaded(self, session_id: str) -> None:
+        if not self._snapshot_path:
+            return
+        with self._lock:
+            if session_id in self._sessions:
+                return
+            messages = self._saving.get(session_id)
+        if messages is None:
+            messages = self._load_snapshot(session_id)
+        with self._lock:
+            # the session might have been loaded by another thread meanwhile
+            if session_id not in self._sessions:
+                buffer = _SessionBuffer(deque(messages, maxlen=self._max_messages))
+                self._sessions[session_id] = buffer
+                self._total_chars += buffer.chars
+                evicted = self._evict_exceeding()
+            else:
+                evicted = []
+        self._save_snapshots(evicted)
+
+    def _get_buffer(self, session_id: str) -> _SessionBuffer:
+        ret = self._sessions.get(session_id)
+        if ret is None:
+            # the session was loaded before, but it might have been evicted by another thread meanwhile
+            ret = _SessionBuffer(deque(self._saving.get(session_id, []), maxlen=self._max_messages))
+            self._sessions[session_id] = ret
+            self._total_chars += ret.chars
+        else:
+            self._sessions.move_to_end(session_id)
+        ret.last_used = time.monotonic()
+        return ret
+
+    def _add_chars(self, buffer: _SessionBuffer, chars: int) -> None:
+        buffer.chars += chars
+        self._total_chars += chars
+
+    def _remove_chars(self, buffer: _SessionBuffer, chars: int) -> None:
+        buffer.chars -= chars
+        self._total_chars -= chars
+
+    def _evict_idle(self) -> List[Tuple[str, List[BaseMessage]]]:
+        ret = []
+        deadline = time.monotonic() - self._idle_ttl
+        # sessions are sorted by last use, so only the oldest ones need to be checked
+        while self._sessions:
+            session_id, buffer = next(iter(self._sessions.items()))
+            if buffer.last_used > deadline:
+                break
+            ret.append(self._evict(session_id))
+        return ret
+
+    def _evict_exceeding(self) -> List[Tuple[str, List[BaseMessage]]]:
+        ret = []
+        # the most recently used session is kept even if it exceeds the limit on its own
+        while self._total_chars > self._max_total_chars and len(self._sessions) > 1:
+            ret.append(self._evict(next(iter(self._sessions))))
+        return ret
+
+    def _evict(self, session_id: str) -> Tuple[str, List[BaseMessage]]:
+        buffer = self._sessions.pop(session_id)
+        self._total_chars -= buffer.chars
+        messages = list(buffer.messages)
+        if self._snapshot_path:
+            self._saving[session_id] = messages
+        return session_id, messages
+
+    def _save_snapshots(self, sessions: List[Tuple[str, List[BaseMessage]]]) -> None:
+        if not self._snapshot_path:
+            return
+        for session_id, messages in sessions:
+            self._save_snapshot(session_id, messages)
+            with self._lock:
+                if self._saving.get(session_id) is messages:
+                    del self._saving[session_id]
+
+    def _get_snapshot_file_path(self, session_id: str) -> str:
+        # session ids come from request paths, so they are validated before using them in paths
+        return os.path.join(self._snapshot_path, f"{uuid.UUID(session_id)}.json")
+
+    def _save_snapshot(self, session_id: str, messages: List[BaseMessage]) -> None:
+        try:
+            os.makedirs(self._snapshot_path, exist_ok=True)
+            with open(self._get_snapshot_file_path(session_id), "w") as f:
+                json.dump(messages_to_dict(messages), f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not save snapshot of session %s: %s", session_id, e)
+
+    def _load_snapshot(self, session_id: str) -> List[BaseMessage]:
+        if not self._snapshot_path:
+            return []
+        try:
+            with open(self._get_snapshot_file_path(session_id)) as f:
+                return messages_from_dict(json.load(f))
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load snapshot of session %s: %s", session_id, e)
+            return []
+
+
+session_memory = SessionMemory(
+    int(os.getenv("SESSION_MEMORY_MAX_MESSAGES", "20")),
+    float(os.getenv("SESSION_MEMORY_IDLE_TTL_SECONDS", "1800")),
+    int(os.getenv("SESSION_MEMORY_MAX_TOTAL_CHARS", "100000000")),
+    os.getenv("SESSION_MEMORY_SNAPSHOT_PATH") or None)
@@ -1,7 +1,10 @@
 import datetime
 from langchain.tools import tool
 
+from tool_cache import no_tool_cache
 
+
+@no_tool_cache
 @tool
 def clock():
     """Obtiene la hora actual || gets the current time"""